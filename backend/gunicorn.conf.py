@@ -0,0 +1,37 @@
+# Multi-worker deployment: gunicorn -c gunicorn.conf.py main:app (run from backend/)
+import gc
+import os
+import multiprocessing
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", min(multiprocessing.cpu_count(), 4)))
+worker_class = "uvicorn.workers.UvicornWorker"
+# LLM pipelines can take minutes per dictation
+timeout = int(os.getenv("WORKER_TIMEOUT", "300"))
+# Import the app once in the master so read-only state is shared copy-on-write with workers
+preload_app = True
+
+# With several workers, per-process chat sessions would break follow-up turns
+if workers > 1:
+    os.environ.setdefault("CHAT_SESSION_STORE", "shared")
+
+
+def on_starting(server):
+    """Compile shared read-only data in the master before any worker forks."""
+    from services.templates import build_template_pack
+    from services.shared_store import SHARED_STORE, FileStore
+
+    server.log.info(f"Template pack ready at {build_template_pack()}")
+    if SHARED_STORE == "file":
+        server.log.info(f"Purged {FileStore().purge_expired()} expired shared store entries")
+
+
+def when_ready(server):
+    """Runs in the master after preloading, just before workers are forked."""
+    from services.protocol_classifier import get_protocol_classifier
+
+    # Builds the vectors file if needed; the vectors themselves are mmap'd, so workers share those pages
+    get_protocol_classifier()
+    # Keep the remaining loaded objects out of the GC's tracked generations so collections in
+    # workers do not touch (and copy) the shared pages
+    gc.freeze()
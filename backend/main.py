@@ -1,16 +1,24 @@
 import os
 from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Body
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import FileResponse
 import shutil
 from typing import List, Optional, Dict, Any
 import json
 from pathlib import Path
-from services.langgraph_engine import workflow
+from services.langgraph_engine import workflow, speculative_workflow, SPECULATIVE_EXTRACTION, EMPTY_EXTRACTION_STATS
 from services.report_gen import generate_radiology_report
 from services.transcription import get_transcription_service
-from pydantic import BaseModel
-from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
+from services.protocol_classifier import get_protocol_classifier
+from services.model_router import get_model_router, TIERS
+from services.chat_sessions import get_session_store, create_session, build_chat_messages, record_turn
+from services.shared_store import get_shared_store
+from services.templates import load_index, load_template
+from services.segments import SegmentStore, link_fields
+import hashlib
+from pydantic import BaseModel, Field
+from langchain_core.messages import SystemMessage, HumanMessage
 import openai
 from dotenv import load_dotenv
 
@@ -19,10 +27,22 @@ openai.api_key = os.getenv("OPENAI_API_KEY")
 
 class ChatRequest(BaseModel):
     message: str
+    # With a live session_id only the message is needed; the rest seeds a new session
+    session_id: Optional[str] = None
+    transcript: Optional[str] = None
+    body_part: Optional[str] = None
+    template_id: Optional[str] = None
+    history: List[Dict[str, str]] = []
+
+class ChatSessionRequest(BaseModel):
     transcript: str
     body_part: str
     template_id: str
-    history: List[Dict[str, str]] = []
+
+class ClassifyRequest(BaseModel):
+    transcript: str
+    top_k: int = Field(5, ge=1, le=20)
+    use_llm_fallback: bool = True
 
 app = FastAPI(title="Radiology Voice-to-Report API")
 
@@ -37,40 +57,58 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-TEMPLATES_DIR = Path("../CAP templates/JSON_Output")
+# Extraction results live in the shared store so every worker sees them
+EXTRACTION_CACHE_TTL_SECONDS = int(os.getenv("EXTRACTION_CACHE_TTL", "86400"))
 TEMP_AUDIO_DIR = Path("temp_audio")
 TEMP_AUDIO_DIR.mkdir(exist_ok=True)
 
+@app.on_event("startup")
+async def load_protocol_classifier():
+    """Load the precomputed protocol vectors once, before the first request."""
+    get_protocol_classifier()
+
 @app.get("/templates")
 async def get_templates():
     """List available radiology templates (body parts)."""
-    templates = []
-    if not TEMPLATES_DIR.exists():
+    try:
+        index = load_index()
+    except FileNotFoundError:
         return []
     
-    for file in TEMPLATES_DIR.glob("*.json"):
-        with open(file, 'r') as f:
-            data = json.load(f)
-            templates.append({
-                "id": data.get("template_id"),
-                "name": data.get("organ", file.stem),
-                "filename": file.name
-            })
-    return templates
+    return [
+        {
+            "id": entry["template_id"],
+            "name": entry.get("organ"),
+            "filename": entry["filename"]
+        }
+        for entry in index.get("templates", [])
+    ]
 
 @app.get("/template/{filename}")
 async def get_template_details(filename: str):
     """Get full details of a specific template."""
-    file_path = TEMPLATES_DIR / filename
-    if not file_path.exists():
+    # Resolve through the index: a few filenames (e.g. "... (1).json") differ from their template_id
+    entry = next((t for t in load_index().get("templates", []) if t["filename"] == filename), None)
+    template = load_template(entry["template_id"] if entry else Path(filename).stem)
+    if template is None:
         raise HTTPException(status_code=404, detail="Template not found")
-    
-    with open(file_path, 'r') as f:
-        return json.load(f)
+    return template
+
+@app.post("/classify")
+def classify_protocol(request: ClassifyRequest):
+    """Rank CAP templates for a transcript, falling back to the LLM only when unsure.
+    A plain def so FastAPI runs it in the threadpool: the LLM fallback is a blocking call."""
+    return get_protocol_classifier().classify(request.transcript, request.top_k, request.use_llm_fallback)
 
 @app.post("/transcribe")
-async def transcribe_audio(audio: UploadFile = File(...), body_part_id: str = Form(...)):
-    """Transcribe audio and refine with medical terminology using LangGraph."""
+async def transcribe_audio(
+    audio: UploadFile = File(...),
+    body_part_id: Optional[str] = Form(None),
+    speculative: Optional[bool] = Form(None)
+):
+    """Transcribe audio and refine with medical terminology using LangGraph.
+    If body_part_id is omitted, the template is identified from the transcript.
+    speculative runs extraction in parallel with refinement (defaults to SPECULATIVE_EXTRACTION)."""
     # Save temp audio
     file_path = TEMP_AUDIO_DIR / audio.filename
     with open(file_path, "wb") as buffer:
@@ -83,83 +121,143 @@ async def transcribe_audio(audio: UploadFile = File(...), body_part_id: str = Fo
         raw_transcript = ts_service.format_segments_to_string(segments)
     except Exception as e:
         # Fallback for testing
-        raw_transcript = f"[0.00 - 5.00] Machine error transcription for {body_part_id}. Finding: 3cm mass."
-        segments = [{"text": "Machine error transcription", "start": 0.0, "end": 5.0}]
+        segments = [{"text": f"Machine error transcription for {body_part_id}. Finding: 3cm mass.", "start": 0.0, "end": 5.0}]
+        raw_transcript = f"[0.00 - 5.00] {segments[0]['text']}"
         print(f"Transcription error: {e}")
 
+    # Prompts get timestamp-free text; the segment store maps text spans back to audio time
+    segment_store = SegmentStore.from_segments(segments)
+    prompt_transcript = segment_store.text
+
+    # Identify the protocol locally when the client did not pick one
+    classification = None
+    if not body_part_id:
+        # The LLM fallback blocks, so keep it off the event loop
+        classification = await run_in_threadpool(get_protocol_classifier().classify, prompt_transcript)
+        if not classification["template_id"]:
+            raise HTTPException(status_code=422, detail="Could not identify a template for this dictation")
+        body_part_id = classification["template_id"]
+
     # 2. Refine and Extract using LangGraph
     body_part_name = body_part_id.split("_")[0]
     
     initial_state = {
         "audio_path": str(file_path),
         "body_part": body_part_name,
-        "raw_transcript": raw_transcript,
-        "segments": segments,
+        "raw_transcript": prompt_transcript,
+        "segments": segment_store.to_dicts(),
         "template_id": body_part_id,
         "extracted_data": {},
         "iteration_count": 0,
         "missing_fields": [],
-        "errors": []
+        "errors": [],
+        "extraction_stats": {}
     }
     
-    final_state = await workflow.ainvoke(initial_state)
+    use_speculative = SPECULATIVE_EXTRACTION if speculative is None else speculative
+    store = get_shared_store()
     
-    return {
+    # Identical dictations on the same template and routing config reuse a result computed by any worker
+    router = get_model_router()
+    routing = json.dumps({"tiers": TIERS, "routes": router.routes}, sort_keys=True)
+    cache_key = "extraction:" + hashlib.sha256(
+        f"{body_part_id}|{use_speculative}|{routing}|{prompt_transcript}".encode("utf-8")
+    ).hexdigest()
+    extraction = store.get(cache_key)
+    cached = extraction is not None
+    if cached:
+        # This request made no LLM calls; the stored stats belong to the run that filled the cache
+        extraction["extraction_stats"] = dict(EMPTY_EXTRACTION_STATS)
+    else:
+        graph = speculative_workflow if use_speculative else workflow
+        final_state = await graph.ainvoke(initial_state)
+        extraction = {
+            "refined_transcript": final_state.get("refined_transcript"),
+            "extracted_data": final_state.get("extracted_data"),
+            "extraction_stats": final_state.get("extraction_stats"),
+        }
+        # Never cache a run where a pass failed outright; a retry may do better
+        if not final_state.get("errors"):
+            store.set(cache_key, extraction, ttl=EXTRACTION_CACHE_TTL_SECONDS)
+    
+    # Link each extracted field to the segments (and audio range) that support it
+    template = load_template(body_part_id)
+    provenance = link_fields(
+        segment_store, template, extraction.get("extracted_data") or {}, extraction.get("refined_transcript")
+    ) if template else {}
+    
+    result = {
         "raw_transcript": raw_transcript,
-        "segments": segments,
-        "refined_transcript": final_state.get("refined_transcript"),
-        "extracted_data": final_state.get("extracted_data"),
+        "segments": segment_store.to_dicts(),
+        **extraction,
+        "provenance": provenance,
         "template_id": body_part_id,
-        "audio_url": f"/audio/{audio.filename}"
+        "classification": classification,
+        "audio_url": f"/audio/{audio.filename}",
+        "cached": cached
     }
+    return result
 
 @app.get("/audio/{filename}")
 async def get_audio(filename: str):
     return FileResponse(TEMP_AUDIO_DIR / filename)
 
+def summarize_history(summary: str, turns: List[Dict[str, str]]) -> str:
+    """Fold older chat turns into a short running summary using the fast tier."""
+    transcript = "\n".join(f"{t['role']}: {t['content']}" for t in turns)
+    messages = [
+        SystemMessage(content="Summarize this radiology assistant conversation in a few sentences. Keep clinical facts, field names and decisions."),
+        HumanMessage(content=f"Previous summary: {summary or 'none'}\n\nNew turns:\n{transcript}"),
+    ]
+    try:
+        return get_model_router().invoke("summarize", messages).content
+    except Exception as e:
+        print(f"Chat summary error: {e}")
+        return summary
+
+@app.post("/chat/session")
+async def create_chat_session(request: ChatSessionRequest):
+    """Store the transcript and template server-side so chat turns only send the message."""
+    session = create_session(get_session_store(), request.transcript, request.body_part, request.template_id)
+    return {"session_id": session["session_id"]}
+
+@app.delete("/chat/session/{session_id}")
+async def delete_chat_session(session_id: str):
+    get_session_store().delete(session_id)
+    return {"message": "Session deleted"}
+
 @app.post("/chat")
 async def clinical_chat(request: ChatRequest):
     """Interactive chatbot for clinician assistance."""
-    try:
-        # Load template for context if needed
-        template_content = ""
-        template_path = Path(f"CAP templates/JSON_Output/{request.template_id}.json")
-        if template_path.exists():
-            with open(template_path, 'r') as f:
-                template_content = f.read()
-
-        system_msg = f"""
-        You are a specialized Radiology Assistant. You are helping a radiologist verify and refine a report.
-        
-        CONTEXT:
-        - Body Part: {request.body_part}
-        - Refined Transcript: {request.transcript}
-        - CAP Protocol Questionnaire: {template_content}
-        
-        INSTRUCTIONS:
-        1. Answer clinical questions based ON ONLY the provided transcript and the protocol requirements.
-        2. Help the radiologist find specific information in the transcript.
-        3. Explain protocol fields if asked.
-        4. Be professional, concise, and clinically precise.
-        """
-        
-        messages = [SystemMessage(content=system_msg)]
+    store = get_session_store()
+    session = store.get(request.session_id) if request.session_id else None
+    if session is None:
+        if request.transcript is None or not request.template_id:
+            if request.session_id:
+                raise HTTPException(status_code=404, detail="Chat session not found or expired")
+            raise HTTPException(status_code=422, detail="session_id, or transcript and template_id, are required")
+        # Legacy clients (and expired sessions) send the full context; seed a session from it
+        session = create_session(store, request.transcript, request.body_part or "", request.template_id)
         for msg in request.history:
-            if msg["role"] == "user":
-                messages.append(HumanMessage(content=msg["content"]))
-            else:
-                messages.append(AIMessage(content=msg["content"]))
-        
-        messages.append(HumanMessage(content=request.message))
-        
-        # Using the same LLM instance from services.langgraph_engine
-        from services.langgraph_engine import llm
-        response = llm.invoke(messages)
-        
-        return {"response": response.content}
+            session["history"].append({"role": msg["role"], "content": msg["content"]})
+
+    try:
+        response = get_model_router().invoke("chat", build_chat_messages(session, request.message))
     except Exception as e:
         print(f"Chat error: {e}")
-        return {"response": "System error. Please try again."}
+        return {"response": "System error. Please try again.", "session_id": session["session_id"]}
+
+    record_turn(session, request.message, response.content, summarize_history)
+    store.put(session["session_id"], session)
+    return {"response": response.content, "session_id": session["session_id"]}
+
+@app.get("/routing/stats")
+async def get_routing_stats():
+    """
+    Latency and token usage per node/model route, for tuning MODEL_ROUTES.
+    Counters are kept per worker process: with several workers this is one worker's share, identified by pid.
+    """
+    return {"pid": os.getpid(), "routes": get_model_router().stats()}
 
 @app.post("/generate-report")
 async def generate_report_endpoint(
@@ -167,12 +265,9 @@ async def generate_report_endpoint(
     template_id: str = Body(...)
 ):
     """Generate final DOCX report from structured data."""
-    template_path = TEMPLATES_DIR / f"{template_id}.json"
-    if not template_path.exists():
+    template_info = load_template(template_id)
+    if template_info is None:
         raise HTTPException(status_code=404, detail="Template not found")
-        
-    with open(template_path, 'r') as f:
-        template_info = json.load(f)
     
     output_filename = f"report_{template_id}.docx"
     output_path = TEMP_AUDIO_DIR / output_filename
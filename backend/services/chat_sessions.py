@@ -0,0 +1,173 @@
+import os
+import json
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+from langchain_core.messages import BaseMessage, SystemMessage, HumanMessage, AIMessage
+
+from services.templates import load_template
+from services.shared_store import SharedStore, get_shared_store
+
+# Which SessionStore implementation get_session_store() returns: "memory" or "shared" (multi-worker)
+CHAT_SESSION_STORE = os.getenv("CHAT_SESSION_STORE", "memory")
+SESSION_TTL_SECONDS = int(os.getenv("CHAT_SESSION_TTL", "3600"))
+MAX_SESSIONS = int(os.getenv("CHAT_MAX_SESSIONS", "1000"))
+# Turns kept verbatim; older turns are folded into the running summary
+RECENT_TURNS = int(os.getenv("CHAT_RECENT_TURNS", "6"))
+# Older turns are folded this many at a time, so only one turn in SUMMARY_BATCH_TURNS pays for a summary call
+SUMMARY_BATCH_TURNS = int(os.getenv("CHAT_SUMMARY_BATCH_TURNS", str(RECENT_TURNS)))
+
+
+class SessionStore:
+    """Interface for chat session storage. Sessions are plain JSON-serialisable dicts."""
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def put(self, session_id: str, session: Dict[str, Any]):
+        raise NotImplementedError
+
+    def delete(self, session_id: str):
+        raise NotImplementedError
+
+
+class InMemorySessionStore(SessionStore):
+    """Per-process store with TTL eviction (refreshed on every write) and an LRU size cap."""
+
+    def __init__(self, ttl_seconds: int = SESSION_TTL_SECONDS, max_sessions: int = MAX_SESSIONS):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _evict(self, now: float):
+        expired = [sid for sid, (expires, _) in self._sessions.items() if expires <= now]
+        for sid in expired:
+            del self._sessions[sid]
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            self._evict(time.time())
+            entry = self._sessions.get(session_id)
+            return entry[1] if entry else None
+
+    def put(self, session_id: str, session: Dict[str, Any]):
+        with self._lock:
+            now = time.time()
+            self._sessions[session_id] = (now + self.ttl_seconds, session)
+            self._sessions.move_to_end(session_id)
+            self._evict(now)
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+
+class SharedSessionStore(SessionStore):
+    """Sessions kept in the shared store so any worker can serve any turn."""
+
+    def __init__(self, store: SharedStore, ttl_seconds: int = SESSION_TTL_SECONDS):
+        self.store = store
+        self.ttl_seconds = ttl_seconds
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        return self.store.get(f"chat_session:{session_id}")
+
+    def put(self, session_id: str, session: Dict[str, Any]):
+        self.store.set(f"chat_session:{session_id}", session, ttl=self.ttl_seconds)
+
+    def delete(self, session_id: str):
+        self.store.delete(f"chat_session:{session_id}")
+
+
+def create_session(store: SessionStore, transcript: str, body_part: str, template_id: str) -> Dict[str, Any]:
+    session = {
+        "session_id": uuid.uuid4().hex,
+        "transcript": transcript,
+        "body_part": body_part,
+        "template_id": template_id,
+        "summary": "",
+        "history": [],
+    }
+    store.put(session["session_id"], session)
+    return session
+
+
+@lru_cache(maxsize=128)
+def _template_prefix(template_id: str) -> str:
+    """
+    The stable part of the system prompt: instructions followed by the protocol.
+    It depends only on the template, so every dictation on the same protocol shares the
+    same prefix and provider-side prompt caching can reuse it.
+    """
+    template = load_template(template_id)
+    template_content = json.dumps(template, separators=(",", ":")) if template else ""
+    return f"""
+    You are a specialized Radiology Assistant. You are helping a radiologist verify and refine a report.
+
+    INSTRUCTIONS:
+    1. Answer clinical questions based ON ONLY the provided transcript and the protocol requirements.
+    2. Help the radiologist find specific information in the transcript.
+    3. Explain protocol fields if asked.
+    4. Be professional, concise, and clinically precise.
+
+    CAP Protocol Questionnaire: {template_content}
+    """
+
+
+def build_chat_messages(session: Dict[str, Any], message: str) -> List[BaseMessage]:
+    """Template-first prompt: stable prefix, then this dictation's context, then the recent turns."""
+    context = f"""
+    CONTEXT:
+    - Body Part: {session['body_part']}
+    - Refined Transcript: {session['transcript']}
+    """
+    if session.get("summary"):
+        context += f"- Earlier conversation (summary): {session['summary']}\n"
+
+    messages = [SystemMessage(content=_template_prefix(session["template_id"])), SystemMessage(content=context)]
+    for msg in session["history"]:
+        if msg["role"] == "user":
+            messages.append(HumanMessage(content=msg["content"]))
+        else:
+            messages.append(AIMessage(content=msg["content"]))
+    messages.append(HumanMessage(content=message))
+    return messages
+
+
+def record_turn(session: Dict[str, Any], message: str, response: str, summarize) -> Dict[str, Any]:
+    """
+    Append a turn. Once SUMMARY_BATCH_TURNS turns beyond RECENT_TURNS have piled up, fold them into the
+    summary in one summarize(previous_summary, turns) call, which returns the new summary text.
+    """
+    session["history"].extend([
+        {"role": "user", "content": message},
+        {"role": "ai", "content": response},
+    ])
+    overflow = len(session["history"]) - RECENT_TURNS * 2
+    if overflow >= max(SUMMARY_BATCH_TURNS, 1) * 2:
+        old_turns = session["history"][:overflow]
+        session["summary"] = summarize(session.get("summary", ""), old_turns)
+        session["history"] = session["history"][overflow:]
+    return session
+
+
+# Singleton instance
+session_store = None
+
+def get_session_store():
+    global session_store
+    if session_store is None:
+        if CHAT_SESSION_STORE == "memory":
+            session_store = InMemorySessionStore()
+        elif CHAT_SESSION_STORE == "shared":
+            session_store = SharedSessionStore(get_shared_store())
+        else:
+            raise ValueError(f"Unknown CHAT_SESSION_STORE: {CHAT_SESSION_STORE}")
+    return session_store
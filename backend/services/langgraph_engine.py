@@ -1,11 +1,13 @@
 import os
-from typing import Annotated, TypedDict, List, Dict, Any
+from typing import Annotated, TypedDict, List, Dict, Any, Optional
 from langgraph.graph import StateGraph, END
-from langchain_openai import ChatOpenAI
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
 import json
-from pathlib import Path
+from services.templates import load_template, iter_fields
+from services.model_router import get_model_router
+from services.segments import SegmentStore, changed_ranges, fields_affected_by_changes, mentioned_fields
+from services.template_schema import NOT_DETERMINED, build_json_schema, validate_extraction, describe_fields
 
 # Load environment variables
 from dotenv import load_dotenv
@@ -27,10 +29,28 @@ class AgentState(TypedDict):
     iteration_count: int
     missing_fields: List[str]
     errors: List[str]
+    extraction_stats: Dict[str, int]
+
+# Counters used to measure wasted passes and repair retries per request
+EMPTY_EXTRACTION_STATS = {
+    "passes": 0,
+    "wasted_passes": 0,
+    "invalid_fields": 0,
+    "repair_requests": 0,
+    "repaired_fields": 0,
+    "reconciled_fields": 0,
+    "escalations": 0,
+}
+
+# A fast-tier full pass is retried on the large tier when it leaves more than this share of the fields
+# whose label the transcript mentions "not determined" (only once at least ESCALATE_MIN_MENTIONED are mentioned)
+ESCALATE_MISSED_RATIO = float(os.getenv("ESCALATE_MISSED_RATIO", "0.5"))
+ESCALATE_MIN_MENTIONED = int(os.getenv("ESCALATE_MIN_MENTIONED", "3"))
+
 
 # LLMs
-# Using OpenAI GPT-4o for medical context refinement and extraction
-llm = ChatOpenAI(model="gpt-4o", openai_api_key=os.getenv("OPENAI_API_KEY"))
+# Each node is routed to a model tier (see services.model_router); extraction escalates to the large tier on failure
+router = get_model_router()
 
 def transcribe_node(state: AgentState):
     """Pass-through for raw transcription data."""
@@ -49,24 +69,62 @@ def refine_transcript_node(state: AgentState):
     """)
     
     human_msg = HumanMessage(content=f"Raw Transcript: {state['raw_transcript']}")
-    response = llm.invoke([system_msg, human_msg])
+    response = router.invoke("refine", [system_msg, human_msg])
     return {"refined_transcript": response.content}
 
-def extract_data_node(state: AgentState):
-    """Extract structured data based on the CAP template JSON schema with a 3-pass self-verification loop."""
-    template_path = Path(f"CAP templates/JSON_Output/{state['template_id']}.json")
-    if not template_path.exists():
-        return {"errors": ["Template not found"]}
+def _missed_mentioned(template_schema: Dict[str, Any], transcript: str, extracted: Dict[str, Any]) -> bool:
+    """True when the transcript mentions enough fields and too many of them came back "not determined"."""
+    mentioned = mentioned_fields(template_schema, transcript)
+    if len(mentioned) < ESCALATE_MIN_MENTIONED:
+        return False
+    missed = sum(1 for fid in mentioned if extracted.get(fid, NOT_DETERMINED) in (NOT_DETERMINED, "", []))
+    return missed / len(mentioned) > ESCALATE_MISSED_RATIO
+
+def _structured_invoke(node: str, messages: List[BaseMessage], schema: Dict[str, Any], escalate: bool = False) -> Optional[Dict[str, Any]]:
+    """Invoke the routed LLM in tool-calling mode constrained to a JSON schema. Returns None if nothing parseable came back."""
+    try:
+        result = router.invoke(node, messages, template_size=len(schema["properties"]), escalate=escalate, schema=schema)
+    except Exception as e:
+        print(f"Structured extraction error: {e}")
+        return None
+    if result.get("parsing_error") is not None or not isinstance(result.get("parsed"), dict):
+        print(f"Extraction parsing error: {result.get('parsing_error')}")
+        return None
+    return result["parsed"]
+
+def repair_fields(template_schema: Dict[str, Any], transcript: str, rejected: Dict[str, Any], reasons: Dict[str, str],
+                  escalate: bool = False) -> Dict[str, Any]:
+    """Re-ask for only the fields whose values failed validation, with a schema limited to those fields."""
+    problems = "\n".join(f"- {fid}: returned {rejected.get(fid)!r} ({reason})" for fid, reason in reasons.items())
+    system_msg = SystemMessage(content=f"""
+    You previously extracted CAP protocol fields from a transcription, but some values are not valid for the protocol.
     
-    with open(template_path, 'r') as f:
-        template_schema = json.load(f)
+    INVALID FIELDS:
+    {problems}
     
-    # Analyze transcript line-by-line for extraction
-    full_transcript = state['refined_transcript']
+    QUESTIONNAIRE ENTRIES FOR THESE FIELDS:
+    {json.dumps(describe_fields(template_schema, reasons), indent=1)}
     
-    # Get current iteration
-    iteration = state.get("iteration_count", 0) + 1
+    For each field, choose the matching technical 'value' from its options (or exact text for free_text fields).
+    If the transcription does not support any option, use "{NOT_DETERMINED}".
+    """)
+    human_msg = HumanMessage(content=f"Transcription: \n{transcript}")
+    return _structured_invoke("repair", [system_msg, human_msg], build_json_schema(template_schema, reasons), escalate) or {}
+
+def _extraction_pass(node: str, state: AgentState, template_schema: Dict[str, Any], full_transcript: str, iteration: int,
+                     target_fields: Optional[List[str]] = None, replace: bool = False):
+    """
+    One extraction call over full_transcript, limited to target_fields when given.
+    The call is routed by node; unparseable output or values that stay invalid after repair are retried on the large tier.
+    With replace=True a new "not determined" overwrites an existing value (used when its supporting text changed).
+    """
     current_extracted = state.get("extracted_data", {})
+    stats = {**EMPTY_EXTRACTION_STATS, **state.get("extraction_stats", {})}
+    
+    if target_fields:
+        questionnaire = describe_fields(template_schema, target_fields)
+    else:
+        questionnaire = template_schema.get('sections', [])
     
     # Sophisticated System Prompt - Questionnaire Style
     system_msg = SystemMessage(content=f"""
@@ -75,7 +133,7 @@ def extract_data_node(state: AgentState):
     
     INPUT DATA:
     1. Body Part: {state['body_part']}
-    2. Questionnaire (CAP Protocol): {json.dumps(template_schema.get('sections', []), indent=1)}
+    2. Questionnaire (CAP Protocol): {json.dumps(questionnaire, indent=1)}
     3. Transcription: {full_transcript}
     
     CRITICAL INSTRUCTIONS:
@@ -83,43 +141,120 @@ def extract_data_node(state: AgentState):
     - Match terminology accurately to the protocol fields.
     - If a field is explicitly stated or strongly implied by medical context, extract the technical 'value' from the corresponding 'options' in the questionnaire.
     - If it's free_text, extract the exact specified details.
-    - IF INFORMATION IS MISSING OR NOT FOUND: Set the value exactly to "not determined".
+    - IF INFORMATION IS MISSING OR NOT FOUND: Set the value exactly to "{NOT_DETERMINED}".
     - PREVIOUS PASS DATA (Current state): {json.dumps(current_extracted, indent=1)}
     
     ITERATION PASS: {iteration}/3
-    In this pass, focus specifically on fields currently marked "not determined" or missing. Double-check the transcript lines to ensure no subtle mention was missed.
+    In this pass, focus specifically on fields currently marked "{NOT_DETERMINED}" or missing. Double-check the transcript lines to ensure no subtle mention was missed.
     
     OUTPUT FORMAT:
-    Return ONLY a valid JSON object where keys are the 'field_id' from the questionnaire and values are the extracted clinical findings (technical values or free text) or "not determined".
+    Call the cap_extraction tool with one argument per 'field_id'. Select fields only accept their listed option values.
     """)
     
     human_msg = HumanMessage(content=f"Focus on refining the extraction. Transcription lines: \n{full_transcript}")
-    response = llm.invoke([system_msg, human_msg])
+    schema = build_json_schema(template_schema, target_fields)
+    new_extracted = _structured_invoke(node, [system_msg, human_msg], schema)
+    stats["passes"] += 1
+    # Escalate a failed pass, or a full pass that missed most of the fields the transcript talks about
+    if router.tier_for(node, len(schema["properties"])) != "large" and (
+        new_extracted is None or (target_fields is None and _missed_mentioned(template_schema, full_transcript, new_extracted))
+    ):
+        escalated = _structured_invoke(node, [system_msg, human_msg], schema, escalate=True)
+        # One of the two calls is discarded: the fast one, or a failed escalation (keeping the fast answer)
+        stats["passes"] += 1
+        stats["wasted_passes"] += 1
+        stats["escalations"] += 1
+        if escalated is not None:
+            new_extracted = escalated
+    errors = list(state.get("errors") or [])
+    if new_extracted is None:
+        stats["wasted_passes"] += 1
+        errors.append(f"{node} pass {iteration} returned no extraction")
+        new_extracted = {}
     
-    try:
-        # Strip potential markdown code blocks
-        clean_content = response.content.replace("```json", "").replace("```", "").strip()
-        new_extracted = json.loads(clean_content)
-        # Merge with existing data (preferring new extractions)
-        merged_extracted = {**current_extracted, **new_extracted}
-    except Exception as e:
-        print(f"Extraction JSON error: {e}")
-        merged_extracted = current_extracted
+    # Validate locally; only the invalid fields go back to the model
+    valid, invalid = validate_extraction(template_schema, new_extracted)
+    if invalid:
+        stats["invalid_fields"] += len(invalid)
+        for escalate in (False, True):
+            if escalate:
+                stats["escalations"] += 1
+            stats["repair_requests"] += 1
+            repaired, _ = validate_extraction(
+                template_schema, repair_fields(template_schema, full_transcript, new_extracted, invalid, escalate)
+            )
+            repaired = {fid: value for fid, value in repaired.items() if fid in invalid}
+            stats["repaired_fields"] += len(repaired)
+            valid.update(repaired)
+            invalid = {fid: reason for fid, reason in invalid.items() if fid not in repaired}
+            if not invalid or router.tier_for("repair", len(invalid)) == "large":
+                break
+    
+    # Merge with existing data (preferring new extractions, but never losing a determined value)
+    merged_extracted = {**current_extracted}
+    for fid, value in valid.items():
+        if replace or value != NOT_DETERMINED or fid not in merged_extracted:
+            merged_extracted[fid] = value
     
     # Identify fields still missing
-    all_field_ids = []
-    for section in template_schema.get('sections', []):
-        for field in section.get('fields', []):
-            all_field_ids.append(field['field_id'])
+    all_field_ids = [field['field_id'] for field in iter_fields(template_schema)]
             
-    missing_now = [fid for fid in all_field_ids if merged_extracted.get(fid) == "not determined" or fid not in merged_extracted]
+    missing_now = [fid for fid in all_field_ids if merged_extracted.get(fid) == NOT_DETERMINED or fid not in merged_extracted]
     
     return {
         "extracted_data": merged_extracted, 
         "iteration_count": iteration, 
-        "missing_fields": missing_now
+        "missing_fields": missing_now,
+        "extraction_stats": stats,
+        "errors": errors
     }
 
+def extract_data_node(state: AgentState):
+    """Extract structured data based on the CAP template JSON schema with a 3-pass self-verification loop."""
+    template_schema = load_template(state['template_id'])
+    if template_schema is None:
+        return {"errors": ["Template not found"]}
+    
+    # Get current iteration; later passes only ask for the fields that are still missing
+    iteration = state.get("iteration_count", 0) + 1
+    target_fields = state.get("missing_fields") if iteration > 1 else None
+    node = "extract" if iteration == 1 else "extract_retry"
+    return _extraction_pass(node, state, template_schema, state['refined_transcript'], iteration, target_fields)
+
+def speculative_extract_node(state: AgentState):
+    """First extraction pass on the raw transcript, run in parallel with refinement."""
+    template_schema = load_template(state['template_id'])
+    if template_schema is None:
+        return {"errors": ["Template not found"]}
+    return _extraction_pass("extract", state, template_schema, state['raw_transcript'], 1)
+
+def _raw_segment_store(state: AgentState) -> SegmentStore:
+    """Segment store whose text is the raw transcript (one pseudo-segment per line if segments do not match)."""
+    store = SegmentStore.from_segments(state.get("segments") or [])
+    if store.text != state['raw_transcript']:
+        lines = state['raw_transcript'].split("\n")
+        store = SegmentStore.from_segments([{"start": 0.0, "end": 0.0, "text": line} for line in lines])
+    return store
+
+def reconcile_extraction_node(state: AgentState):
+    """Once refinement lands, re-extract only the fields whose supporting text it changed."""
+    template_schema = load_template(state['template_id'])
+    if template_schema is None:
+        return {}
+    
+    ranges = changed_ranges(state['raw_transcript'], state['refined_transcript'])
+    affected = []
+    if ranges:
+        affected = fields_affected_by_changes(template_schema, state.get("extracted_data", {}), _raw_segment_store(state),
+                                              ranges, state['refined_transcript'])
+    if not affected:
+        return {}
+    
+    update = _extraction_pass("reconcile", state, template_schema, state['refined_transcript'], state.get("iteration_count", 1),
+                                affected, replace=True)
+    update["extraction_stats"]["reconciled_fields"] += len(affected)
+    return update
+
 def should_continue_extraction(state: AgentState):
     """Route to continue loop or end extraction after 3 passes or no missing fields."""
     if state.get("iteration_count", 0) >= 3:
@@ -128,7 +263,12 @@ def should_continue_extraction(state: AgentState):
         return "end"
     return "continue"
 
-def create_workflow():
+def create_workflow(speculative: bool = False):
+    """
+    Build the transcription graph.
+    speculative=True runs the first extraction on the raw transcript in parallel with refinement
+    and reconciles afterwards, taking one LLM round trip off the critical path.
+    """
     workflow = StateGraph(AgentState)
     
     workflow.add_node("transcribe", transcribe_node)
@@ -137,7 +277,23 @@ def create_workflow():
     
     workflow.set_entry_point("transcribe")
     workflow.add_edge("transcribe", "refine")
-    workflow.add_edge("refine", "extract")
+    
+    if speculative:
+        workflow.add_node("speculative_extract", speculative_extract_node)
+        workflow.add_node("reconcile", reconcile_extraction_node)
+        workflow.add_edge("transcribe", "speculative_extract")
+        # Waits for both branches before reconciling
+        workflow.add_edge(["refine", "speculative_extract"], "reconcile")
+        workflow.add_conditional_edges(
+            "reconcile",
+            should_continue_extraction,
+            {
+                "continue": "extract",
+                "end": END
+            }
+        )
+    else:
+        workflow.add_edge("refine", "extract")
     
     workflow.add_conditional_edges(
         "extract",
@@ -150,4 +306,8 @@ def create_workflow():
     
     return workflow.compile()
 
+# Opt-in, per request or by default via SPECULATIVE_EXTRACTION=true
+SPECULATIVE_EXTRACTION = os.getenv("SPECULATIVE_EXTRACTION", "false").lower() in ("1", "true", "yes")
+
 workflow = create_workflow()
+speculative_workflow = create_workflow(speculative=True)
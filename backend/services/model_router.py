@@ -0,0 +1,123 @@
+import os
+import json
+import time
+import threading
+from typing import Any, Dict, List, Optional
+
+from langchain_openai import ChatOpenAI
+from langchain_core.messages import BaseMessage
+
+from dotenv import load_dotenv
+load_dotenv()
+
+# Model tiers: cheap/low-latency steps use "fast", "large" is the escalation target
+TIERS = {
+    "fast": os.getenv("FAST_MODEL", "gpt-4o-mini"),
+    "large": os.getenv("LARGE_MODEL", "gpt-4o"),
+}
+
+# Templates with more fields than this count as "large" for size-dependent routes
+LARGE_TEMPLATE_FIELDS = int(os.getenv("LARGE_TEMPLATE_FIELDS", "120"))
+
+# Node -> tier, or node -> {"small": tier, "large": tier} when it depends on template size.
+# Override any entry with MODEL_ROUTES, e.g. MODEL_ROUTES='{"refine": "large"}'
+DEFAULT_ROUTES = {
+    "refine": "fast",
+    "extract": {"small": "fast", "large": "large"},
+    "extract_retry": "fast",
+    "repair": "fast",
+    "reconcile": "fast",
+    "classify": "fast",
+    "chat": "large",
+    "summarize": "fast",
+}
+
+
+def _load_routes() -> Dict[str, Any]:
+    routes = dict(DEFAULT_ROUTES)
+    overrides = os.getenv("MODEL_ROUTES")
+    if overrides:
+        try:
+            routes.update(json.loads(overrides))
+        except ValueError as e:
+            print(f"Ignoring invalid MODEL_ROUTES: {e}")
+    return routes
+
+
+class ModelRouter:
+    """Picks a model tier per graph node and records latency and token usage per route (per process)."""
+
+    def __init__(self, routes: Optional[Dict[str, Any]] = None):
+        self.routes = routes if routes is not None else _load_routes()
+        self._llms: Dict[str, ChatOpenAI] = {}
+        self._stats: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def tier_for(self, node: str, template_size: Optional[int] = None) -> str:
+        route = self.routes.get(node, "large")
+        if isinstance(route, dict):
+            size = "large" if template_size is None or template_size > LARGE_TEMPLATE_FIELDS else "small"
+            route = route.get(size, "large")
+        return route if route in TIERS else "large"
+
+    def get_llm(self, tier: str) -> ChatOpenAI:
+        with self._lock:
+            if tier not in self._llms:
+                self._llms[tier] = ChatOpenAI(model=TIERS[tier], openai_api_key=os.getenv("OPENAI_API_KEY"))
+            return self._llms[tier]
+
+    def invoke(self, node: str, messages: List[BaseMessage], template_size: Optional[int] = None,
+               escalate: bool = False, schema: Optional[Dict[str, Any]] = None):
+        """
+        Call the model routed for node. escalate=True forces the large tier.
+        With a schema the call uses tool calling and returns the with_structured_output(include_raw=True) dict.
+        """
+        tier = "large" if escalate else self.tier_for(node, template_size)
+        model = self.get_llm(tier)
+        if schema is not None:
+            model = model.with_structured_output(schema, method="function_calling", include_raw=True)
+
+        started = time.perf_counter()
+        try:
+            result = model.invoke(messages)
+        except Exception:
+            self._record(node, tier, time.perf_counter() - started, None, error=True)
+            raise
+
+        raw = result.get("raw") if schema is not None else result
+        self._record(node, tier, time.perf_counter() - started, getattr(raw, "usage_metadata", None))
+        return result
+
+    def _record(self, node: str, tier: str, elapsed: float, usage: Optional[Dict[str, int]], error: bool = False):
+        key = f"{node}:{tier}"
+        with self._lock:
+            s = self._stats.setdefault(key, {
+                "model": TIERS[tier], "calls": 0, "errors": 0,
+                "total_latency_ms": 0.0, "max_latency_ms": 0.0,
+                "input_tokens": 0, "output_tokens": 0,
+            })
+            s["calls"] += 1
+            s["errors"] += int(error)
+            s["total_latency_ms"] += elapsed * 1000
+            s["max_latency_ms"] = max(s["max_latency_ms"], elapsed * 1000)
+            if usage:
+                s["input_tokens"] += usage.get("input_tokens", 0)
+                s["output_tokens"] += usage.get("output_tokens", 0)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per-route counters with average latency, for tuning the routing policy."""
+        with self._lock:
+            return {
+                key: {**s, "avg_latency_ms": round(s["total_latency_ms"] / s["calls"], 1) if s["calls"] else 0.0}
+                for key, s in self._stats.items()
+            }
+
+
+# Singleton instance
+model_router = None
+
+def get_model_router():
+    global model_router
+    if model_router is None:
+        model_router = ModelRouter()
+    return model_router
@@ -0,0 +1,296 @@
+import os
+import json
+import math
+import mmap
+import time
+import zlib
+import struct
+from array import array
+from bisect import bisect_left
+from typing import Any, Dict, List, Optional, Tuple
+from pathlib import Path
+
+from services.text import WORD_RE
+from services.templates import TEMPLATES_DIR, iter_index_entries, load_template, template_vocabulary, templates_mtime
+
+# Precomputed template vectors live next to the backend, rebuilt when any template changes.
+# Layout: MAGIC | u64 header length | header JSON | padding to 8 bytes | flat arrays of 4-byte items:
+# keys[n_keys] (sorted feature buckets), idf[n_keys], starts[n_keys + 1], postings_template[n_postings],
+# postings_weight[n_postings]. Postings starts[j]:starts[j + 1] list the templates using keys[j].
+# The file is memory-mapped and read through memoryviews, so ranking never touches per-feature Python
+# objects and the pages stay shared between forked workers.
+VECTORS_PATH = Path(os.getenv(
+    "PROTOCOL_VECTORS_PATH",
+    Path(__file__).resolve().parents[1] / "data" / "protocol_vectors.bin"
+))
+VECTORS_VERSION = 4
+MAGIC = b"CAPVEC04"
+_HEADER_LEN = struct.Struct("<Q")
+
+N_FEATURES = 2 ** 18
+CHAR_NGRAMS = (3, 4, 5)
+# Only the strongest features of each template are stored, which keeps the file small
+MAX_FEATURES_PER_TEMPLATE = 4000
+# Organ names and template ids describe the protocol directly, so they outweigh field vocabulary
+ORGAN_BOOST = 3.0
+# Header words that name no organ; boosting them lets "tumor" alone pick the general templates
+GENERIC_HEADER_WORDS = {"general", "tumor", "tumors", "resection", "reporting", "template", "rel", "capcp"}
+# Score multiplier for the catch-all GENERAL TUMOR templates, so any organ-specific match is preferred
+GENERIC_TEMPLATE_PRIOR = 0.8
+
+# Confidence is the top score's relative margin over the runner-up, (s1 - s2) / s1
+CONFIDENCE_THRESHOLD = float(os.getenv("PROTOCOL_CONFIDENCE_THRESHOLD", "0.1"))
+
+
+
+def _bucket(feature: str) -> int:
+    # crc32 is stable across processes, unlike hash()
+    return zlib.crc32(feature.encode("utf-8")) % N_FEATURES
+
+
+def _features(text: str, weight: float = 1.0) -> Dict[int, float]:
+    """Hashed word and character n-gram counts for a piece of text."""
+    counts: Dict[int, float] = {}
+    words = WORD_RE.findall(text.lower())
+    for word in words:
+        key = _bucket(f"w:{word}")
+        counts[key] = counts.get(key, 0.0) + weight
+        padded = f" {word} "
+        for n in CHAR_NGRAMS:
+            for i in range(len(padded) - n + 1):
+                key = _bucket(f"c:{padded[i:i + n]}")
+                counts[key] = counts.get(key, 0.0) + weight
+    return counts
+
+
+def _merge(target: Dict[int, float], counts: Dict[int, float]):
+    for key, value in counts.items():
+        target[key] = target.get(key, 0.0) + value
+
+
+def _tfidf(counts: Dict[int, float], idf: Dict[int, float], max_features: Optional[int] = None) -> Dict[int, float]:
+    """Sublinear TF-IDF, L2 normalised. Features unknown to the index are dropped."""
+    vector = {k: (1.0 + math.log(v)) * idf[k] for k, v in counts.items() if k in idf and v > 0}
+    if max_features is not None and len(vector) > max_features:
+        vector = dict(sorted(vector.items(), key=lambda kv: kv[1], reverse=True)[:max_features])
+    norm = math.sqrt(sum(w * w for w in vector.values()))
+    if not norm:
+        return {}
+    return {k: w / norm for k, w in vector.items()}
+
+
+def build_vectors(output_path: Path = VECTORS_PATH) -> Dict[str, Any]:
+    """Compute TF-IDF vectors for every template in the index and write them to disk."""
+    documents = []
+    for entry in iter_index_entries():
+        template = load_template(entry["template_id"]) or {}
+        counts: Dict[int, float] = {}
+        header = " ".join(filter(None, [entry.get("organ"), entry["template_id"].replace(".", " ").replace("_", " ")]))
+        header_words = WORD_RE.findall(header.lower())
+        _merge(counts, _features(" ".join(w for w in header_words if w not in GENERIC_HEADER_WORDS and not w.isdigit()), ORGAN_BOOST))
+        _merge(counts, _features(" ".join(w for w in header_words if w in GENERIC_HEADER_WORDS)))
+        _merge(counts, _features(" ".join(template_vocabulary(template))))
+        documents.append((entry, counts))
+
+    n_docs = len(documents)
+    df: Dict[int, int] = {}
+    for _, counts in documents:
+        for key in counts:
+            df[key] = df.get(key, 0) + 1
+    idf = {k: math.log((1 + n_docs) / (1 + d)) + 1.0 for k, d in df.items()}
+
+    # Inverted index over the features kept in any template vector
+    templates = []
+    postings: Dict[int, List[Tuple[int, float]]] = {}
+    for i, (entry, counts) in enumerate(documents):
+        for key, weight in _tfidf(counts, idf, MAX_FEATURES_PER_TEMPLATE).items():
+            postings.setdefault(key, []).append((i, weight))
+        templates.append({
+            "template_id": entry["template_id"],
+            "organ": entry.get("organ") or entry["template_id"],
+            "filename": entry["filename"],
+        })
+
+    keys = array("I", sorted(postings))
+    idf_values = array("f", (idf[k] for k in keys))
+    starts, postings_template, postings_weight = array("I", [0]), array("I"), array("f")
+    for key in keys:
+        for i, weight in postings[key]:
+            postings_template.append(i)
+            postings_weight.append(weight)
+        starts.append(len(postings_template))
+
+    header = {
+        "version": VECTORS_VERSION,
+        "source_mtime": templates_mtime(),
+        "n_features": N_FEATURES,
+        "n_keys": len(keys),
+        "n_postings": len(postings_template),
+        "templates": templates,
+    }
+    header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = output_path.with_name(f"{output_path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(_HEADER_LEN.pack(len(header_bytes)))
+        f.write(header_bytes)
+        f.write(b"\0" * (-f.tell() % 8))
+        for values in (keys, idf_values, starts, postings_template, postings_weight):
+            values.tofile(f)
+    os.replace(tmp_path, output_path)
+    return header
+
+
+def _load_vectors(path: Path) -> Optional[Tuple[Dict[str, Any], mmap.mmap, int]]:
+    """(header, mapping, offset of the arrays), or None if the file is missing, from another version or stale."""
+    if not path.exists():
+        return None
+    with open(path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        if mm[:len(MAGIC)] != MAGIC:
+            return None
+        (header_len,) = _HEADER_LEN.unpack_from(mm, len(MAGIC))
+        header_start = len(MAGIC) + _HEADER_LEN.size
+        header = json.loads(mm[header_start:header_start + header_len])
+    except (ValueError, struct.error):
+        return None
+    if header.get("version") != VECTORS_VERSION or header.get("n_features") != N_FEATURES:
+        return None
+    # Any edited template (fields, options) invalidates the vectors, not just index.json
+    if header.get("source_mtime", 0) < templates_mtime():
+        return None
+    data_start = header_start + header_len
+    return header, mm, data_start + (-data_start % 8)
+
+
+class ProtocolClassifier:
+    """Ranks CAP templates for a transcript using precomputed TF-IDF vectors."""
+
+    def __init__(self, vectors_path: Path = VECTORS_PATH, threshold: float = CONFIDENCE_THRESHOLD):
+        self.threshold = threshold
+        loaded = _load_vectors(vectors_path)
+        if loaded is None:
+            print(f"Building protocol vectors from {TEMPLATES_DIR}")
+            build_vectors(vectors_path)
+            loaded = _load_vectors(vectors_path)
+        header, self._mm, offset = loaded
+        self.templates = header["templates"]
+
+        view = memoryview(self._mm)
+        arrays = []
+        for fmt, n in (("I", header["n_keys"]), ("f", header["n_keys"]), ("I", header["n_keys"] + 1),
+                       ("I", header["n_postings"]), ("f", header["n_postings"])):
+            arrays.append(view[offset:offset + 4 * n].cast(fmt))
+            offset += 4 * n
+        self._keys, self._idf, self._starts, self._postings_template, self._postings_weight = arrays
+
+    def rank(self, transcript: str, top_k: int = 5) -> List[Dict[str, Any]]:
+        """
+        Return the top_k templates with their cosine score (times the prior for generic templates).
+        Each candidate's confidence is its relative margin over the best other template, so only the
+        top candidate can be above 0, and close siblings (biopsy vs resection) give a low confidence.
+        """
+        # Sublinear TF-IDF query over the indexed features, keyed by position in keys
+        query = {}
+        for key, count in _features(transcript).items():
+            j = bisect_left(self._keys, key)
+            if j < len(self._keys) and self._keys[j] == key:
+                query[j] = (1.0 + math.log(count)) * self._idf[j]
+        norm = math.sqrt(sum(w * w for w in query.values()))
+        if not norm:
+            return []
+
+        totals = [0.0] * len(self.templates)
+        for j, w in query.items():
+            for p in range(self._starts[j], self._starts[j + 1]):
+                totals[self._postings_template[p]] += w * self._postings_weight[p]
+
+        scores = []
+        for t, total in zip(self.templates, totals):
+            score = total / norm
+            if t["organ"].upper().startswith("GENERAL"):
+                score *= GENERIC_TEMPLATE_PRIOR
+            scores.append((score, t))
+        scores.sort(key=lambda s: s[0], reverse=True)
+
+        best = scores[0][0]
+        runner_up = scores[1][0] if len(scores) > 1 else 0.0
+        return [
+            {
+                "template_id": t["template_id"],
+                "organ": t["organ"],
+                "filename": t["filename"],
+                "score": round(score, 4),
+                "confidence": round((best - runner_up) / best, 4) if i == 0 and best > 0 else 0.0,
+            }
+            for i, (score, t) in enumerate(scores[:top_k])
+        ]
+
+    def classify(self, transcript: str, top_k: int = 5, use_llm_fallback: bool = True) -> Dict[str, Any]:
+        """
+        Pick a template for a transcript.
+        Uses the local ranking when the top candidate clears the confidence threshold,
+        otherwise asks the LLM to choose among the local candidates.
+        """
+        started = time.perf_counter()
+        candidates = self.rank(transcript, top_k)
+        result = {
+            "template_id": None,
+            "organ": None,
+            "filename": None,
+            "confidence": 0.0,
+            "method": "local",
+            "candidates": candidates,
+        }
+        if candidates:
+            result.update({k: candidates[0][k] for k in ("template_id", "organ", "filename", "confidence")})
+
+        if use_llm_fallback and candidates and result["confidence"] < self.threshold:
+            choice = self._llm_choose(transcript, candidates)
+            if choice is not None:
+                result.update({k: choice[k] for k in ("template_id", "organ", "filename", "confidence")})
+                result["method"] = "llm"
+
+        result["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        return result
+
+    def _llm_choose(self, transcript: str, candidates: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """Ask the LLM to pick one of the local candidates. Returns None on failure."""
+        from langchain_core.messages import SystemMessage, HumanMessage
+        from services.model_router import get_model_router
+
+        options = "\n".join(f"- {c['template_id']}: {c['organ']}" for c in candidates)
+        system_msg = SystemMessage(content=f"""
+        You are selecting the CAP cancer protocol template that matches a pathology/radiology dictation.
+        Candidate templates:
+        {options}
+        Return ONLY the template id of the best match, exactly as listed.
+        """)
+        human_msg = HumanMessage(content=f"Transcript: {transcript}")
+        try:
+            response = get_model_router().invoke("classify", [system_msg, human_msg])
+        except Exception as e:
+            print(f"Protocol classification LLM error: {e}")
+            return None
+
+        answer = response.content.strip().strip("`").strip()
+        return next((c for c in candidates if c["template_id"] == answer), None)
+
+
+# Singleton instance
+protocol_classifier = None
+
+def get_protocol_classifier():
+    global protocol_classifier
+    if protocol_classifier is None:
+        protocol_classifier = ProtocolClassifier()
+    return protocol_classifier
+
+
+if __name__ == "__main__":
+    # Precompute vectors, e.g. during a Docker build: python -m services.protocol_classifier
+    header = build_vectors()
+    print(f"Wrote {len(header['templates'])} template vectors to {VECTORS_PATH}")
@@ -33,11 +33,17 @@ def generate_radiology_report(data: dict, template_info: dict, output_path: str)
             p.add_run(f"{label}: ").bold = True
             
             display_value = "not determined"
-            if value and value != "not_determined":
+            if value and value not in ("not_determined", "not determined"):
                 # Try to map value to label if options exist
                 if "options" in field:
-                    option_label = next((opt["label"] for opt in field["options"] if opt["value"] == value), None)
-                    display_value = option_label if option_label else value
+                    labels = {opt["value"]: opt["label"] for opt in field["options"]}
+                    # multi_select values are lists (or comma-joined once edited as text in the UI)
+                    if isinstance(value, str) and value not in labels and "," in value:
+                        value = [v.strip() for v in value.split(",")]
+                    if isinstance(value, list):
+                        display_value = ", ".join(labels.get(v, str(v)) for v in value)
+                    else:
+                        display_value = labels.get(value, value)
                 else:
                     display_value = value
             
@@ -0,0 +1,343 @@
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from difflib import SequenceMatcher
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from services.templates import iter_fields
+from services.template_schema import NOT_DETERMINED
+from services.text import WORD_RE, content_words
+
+# Trailing "(specify): ____" style placeholders in option labels
+PLACEHOLDER_RE = re.compile(r"\(?[a-z ]*\)?:?\s*_{3,}.*$", re.IGNORECASE)
+# Share of a field label's (weighted) words a line must contain to count as mentioning the field
+LABEL_MATCH = 0.5
+
+
+class SegmentStore:
+    """
+    Timestamped transcript segments kept in parallel arrays.
+    text is the timestamp-free transcript sent to prompts (one segment per line);
+    offsets[i] is where segment i starts in text, so character spans map back to audio time.
+    """
+
+    def __init__(self, starts: array, ends: array, offsets: array, text: str):
+        self.starts = starts
+        self.ends = ends
+        self.offsets = offsets
+        self.text = text
+        self._lower = text.lower()
+        # Running maximum of ends: non-decreasing, so it can be bisected even if segments overlap
+        self._max_ends = array("d")
+        running = float("-inf")
+        for end in ends:
+            running = max(running, end)
+            self._max_ends.append(running)
+
+    @classmethod
+    def from_segments(cls, segments: List[Dict[str, Any]]) -> "SegmentStore":
+        ordered = sorted(segments, key=lambda s: (s["start"], s["end"]))
+        starts, ends, offsets = array("d"), array("d"), array("q")
+        lines = []
+        position = 0
+        for s in ordered:
+            line = s["text"].strip()
+            starts.append(float(s["start"]))
+            ends.append(float(s["end"]))
+            offsets.append(position)
+            lines.append(line)
+            position += len(line) + 1
+        return cls(starts, ends, offsets, "\n".join(lines))
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def segment_text(self, i: int) -> str:
+        end = self.offsets[i + 1] - 1 if i + 1 < len(self) else len(self.text)
+        return self.text[self.offsets[i]:end]
+
+    def to_dicts(self) -> List[Dict[str, Any]]:
+        return [{"start": self.starts[i], "end": self.ends[i], "text": self.segment_text(i)} for i in range(len(self))]
+
+    def at_time(self, t: float) -> List[int]:
+        """Indices of segments whose [start, end] contains t."""
+        return self.between(t, t)
+
+    def between(self, t0: float, t1: float) -> List[int]:
+        """Indices of segments overlapping [t0, t1]."""
+        first = bisect_left(self._max_ends, t0)
+        last = bisect_right(self.starts, t1)
+        return [i for i in range(first, last) if self.ends[i] >= t0]
+
+    def segment_at_offset(self, offset: int) -> int:
+        return max(bisect_right(self.offsets, offset) - 1, 0)
+
+    def span(self, char_start: int, char_end: int) -> Dict[str, Any]:
+        """Segments and audio time range behind a character span of text. The store must not be empty."""
+        first = self.segment_at_offset(char_start)
+        last = self.segment_at_offset(max(char_end - 1, char_start))
+        return {
+            "char_start": char_start,
+            "char_end": char_end,
+            "segment_start": first,
+            "segment_end": last,
+            "start": self.starts[first],
+            "end": self.ends[last],
+        }
+
+    def offset_map(self, other: str):
+        """
+        Map character offsets in other (e.g. the refined transcript) to offsets in text,
+        by aligning the two word sequences. Returns a function offset -> offset.
+        """
+        mine = [(m.start(), m.group()) for m in WORD_RE.finditer(self._lower)]
+        theirs = [(m.start(), m.group()) for m in WORD_RE.finditer(other.lower())]
+        matcher = SequenceMatcher(None, [w for _, w in theirs], [w for _, w in mine], autojunk=False)
+        their_starts, my_starts = array("q"), array("q")
+        for block in matcher.get_matching_blocks():
+            for k in range(block.size):
+                their_starts.append(theirs[block.a + k][0])
+                my_starts.append(mine[block.b + k][0])
+
+        def to_text_offset(offset: int) -> int:
+            k = bisect_right(their_starts, offset) - 1
+            if k < 0:
+                return 0
+            return my_starts[k] + (offset - their_starts[k])
+
+        return to_text_offset
+
+    def locate(self, snippet: str, other: Optional[str] = None, mapper=None) -> Optional[Dict[str, Any]]:
+        """
+        Find snippet in text (or in other, mapped back through offset_map) and return its span.
+        Falls back to the segment sharing the most content words with the snippet.
+        """
+        needle = snippet.strip().lower()
+        if not needle or len(self) == 0:
+            return None
+        pattern = _word_pattern(needle)
+        found = pattern.search(self._lower)
+        if found:
+            return self.span(found.start(), found.end())
+        if other is not None and mapper is not None:
+            found = pattern.search(other.lower())
+            if found:
+                start = mapper(found.start())
+                return self.span(start, max(mapper(found.end()), start + 1))
+
+        words = set(content_words(WORD_RE.findall(needle)))
+        if not words:
+            return None
+        best, best_score = None, 0
+        for i in range(len(self)):
+            score = len(words & set(WORD_RE.findall(self.segment_text(i).lower())))
+            if score > best_score:
+                best, best_score = i, score
+        if best is None or best_score * 2 < len(words):
+            return None
+        return self.span(self.offsets[best], self.offsets[best] + len(self.segment_text(best)))
+
+
+def value_snippets(field: Dict[str, Any], value: Any) -> List[str]:
+    """Text a value is likely dictated as: free text itself, or the option label and value."""
+    options = {opt["value"]: opt.get("label", "") for opt in field.get("options", [])}
+    snippets = []
+    for v in value if isinstance(value, list) else [value]:
+        if not isinstance(v, str):
+            continue
+        if v in options:
+            label = PLACEHOLDER_RE.sub("", options[v]).strip()
+            snippets.extend(s for s in (label, v.replace("_", " ")) if s)
+        else:
+            snippets.append(v)
+    return snippets
+
+
+def _is_distinctive(field: Dict[str, Any], snippet: str) -> bool:
+    """Free text, or an option with several content words; generic options ("Not identified", "Present") are not."""
+    option_texts = set()
+    for opt in field.get("options", []):
+        option_texts.add(opt["value"].replace("_", " ").lower())
+        option_texts.add(PLACEHOLDER_RE.sub("", opt.get("label", "")).strip().lower())
+    needle = snippet.strip().lower()
+    return needle not in option_texts or len(content_words(WORD_RE.findall(needle))) >= 2
+
+
+def _label_words(field: Dict[str, Any]) -> Set[str]:
+    return set(content_words(WORD_RE.findall(PLACEHOLDER_RE.sub("", field.get("label", "")).lower())))
+
+
+def label_weights(template: Dict[str, Any]) -> Dict[str, float]:
+    """Label word -> 1 / number of field labels containing it, so words shared by many labels count for less."""
+    df: Dict[str, int] = {}
+    for field in iter_fields(template):
+        for word in _label_words(field):
+            df[word] = df.get(word, 0) + 1
+    return {word: 1.0 / n for word, n in df.items()}
+
+
+def _word_pattern(snippet: str):
+    # Whole words only, so e.g. "present" does not match inside "represents"
+    return re.compile(r"(?<!\w)" + re.escape(snippet.strip().lower()) + r"(?!\w)")
+
+
+def _lines(lower: str) -> List[Tuple[int, int]]:
+    lines, position = [], 0
+    for line in lower.split("\n"):
+        lines.append((position, position + len(line)))
+        position += len(line) + 1
+    return lines
+
+
+def _label_mentions(lower: str, lines: List[Tuple[int, int]], field: Dict[str, Any],
+                    weights: Dict[str, float]) -> List[Tuple[float, int, int]]:
+    """(-score, line, offset of the first label word) for each line mentioning the field label, best first."""
+    label = _label_words(field)
+    total = sum(weights.get(w, 1.0) for w in label)
+    if not total:
+        return []
+    mentions = []
+    for i, (a, b) in enumerate(lines):
+        words = [(m.start(), m.group()) for m in WORD_RE.finditer(lower, a, b) if m.group() in label]
+        score = sum(weights.get(w, 1.0) for w in {w for _, w in words}) / total
+        if score >= LABEL_MATCH:
+            mentions.append((-score, i, words[0][0]))
+    mentions.sort()
+    return mentions
+
+
+def mentioned_fields(template: Dict[str, Any], text: str) -> List[str]:
+    """Ids of the fields whose label is mentioned on some line of text."""
+    lower = text.lower()
+    lines = _lines(lower)
+    weights = label_weights(template)
+    found = []
+    for field in iter_fields(template):
+        if field["field_id"] not in found and _label_mentions(lower, lines, field, weights):
+            found.append(field["field_id"])
+    return found
+
+
+def _anchored_match(lower: str, field: Dict[str, Any], snippets: List[str], weights: Dict[str, float]):
+    """
+    Look for a value right after a mention of its field label, line by line (one line per segment).
+    Returns (value match range or None, best label mention line range or None).
+    """
+    if not snippets:
+        return None, None
+    lines = _lines(lower)
+    mentions = _label_mentions(lower, lines, field, weights)
+
+    patterns = [_word_pattern(s) for s in snippets]
+    for _, i, label_start in mentions:
+        # The value usually follows the label, on the same line or the next one
+        end = lines[min(i + 1, len(lines) - 1)][1]
+        for start in (label_start, lines[i][0]):
+            hits = [m for m in (p.search(lower, start, end) for p in patterns) if m]
+            if hits:
+                first = min(hits, key=lambda m: m.start())
+                return (first.start(), first.end()), None
+    return None, (lines[mentions[0][1]] if mentions else None)
+
+
+def locate_field(store: SegmentStore, field: Dict[str, Any], value: Any, weights: Dict[str, float],
+                 refined_transcript: Optional[str] = None, mapper=None) -> Optional[Dict[str, Any]]:
+    """
+    Span of the text supporting a field's value. Values are matched after a mention of the field label
+    (in text, then in refined_transcript mapped back), so fields sharing generic options such as
+    "Not identified" link to their own segment. Only distinctive values are searched for on their own;
+    otherwise the line mentioning the label is returned.
+    """
+    if len(store) == 0:
+        return None
+    snippets = [s for s in value_snippets(field, value) if s.strip()]
+    found, mention = _anchored_match(store._lower, field, snippets, weights)
+    if found is not None:
+        return store.span(*found)
+    if refined_transcript is not None and mapper is not None:
+        other_found, _ = _anchored_match(refined_transcript.lower(), field, snippets, weights)
+        if other_found is not None:
+            start = mapper(other_found[0])
+            return store.span(start, max(mapper(other_found[1]), start + 1))
+
+    for snippet in snippets:
+        if _is_distinctive(field, snippet):
+            span = store.locate(snippet, refined_transcript, mapper)
+            if span is not None:
+                return span
+    if mention is not None:
+        return store.span(*mention)
+    return None
+
+
+def link_fields(store: SegmentStore, template: Dict[str, Any], extracted: Dict[str, Any],
+                refined_transcript: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+    """field_id -> span (segments, audio start/end) of the transcript text supporting each determined field."""
+    if len(store) == 0:
+        return {}
+    mapper = store.offset_map(refined_transcript) if refined_transcript else None
+    weights = label_weights(template)
+    provenance = {}
+    for field in iter_fields(template):
+        fid = field["field_id"]
+        value = extracted.get(fid)
+        if value in (None, "", [], NOT_DETERMINED) or fid in provenance:
+            continue
+        span = locate_field(store, field, value, weights, refined_transcript, mapper)
+        if span is not None:
+            provenance[fid] = span
+    return provenance
+
+
+def changed_ranges(raw: str, refined: str) -> List[Tuple[int, int]]:
+    """
+    Character ranges of raw that refinement rewrote (case and punctuation ignored).
+    Pure insertions give an empty range at the insertion point; edits touching only stopwords or short
+    non-numeric words are skipped.
+    """
+    raw_tokens = [(m.start(), m.end(), m.group()) for m in WORD_RE.finditer(raw.lower())]
+    refined_words = WORD_RE.findall(refined.lower())
+    matcher = SequenceMatcher(None, [w for _, _, w in raw_tokens], refined_words, autojunk=False)
+    ranges = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            continue
+        words = [w for _, _, w in raw_tokens[i1:i2]] + refined_words[j1:j2]
+        # Numbers always matter (sizes, counts); other short words and stopwords do not
+        if not content_words(words) and not any(w.isdigit() for w in words):
+            continue
+        if i1 < i2:
+            ranges.append((raw_tokens[i1][0], raw_tokens[i2 - 1][1]))
+        else:
+            position = raw_tokens[i1][0] if i1 < len(raw_tokens) else len(raw)
+            ranges.append((position, position))
+    return ranges
+
+
+def fields_affected_by_changes(template: Dict[str, Any], extracted: Dict[str, Any], store: SegmentStore,
+                               ranges: List[Tuple[int, int]], refined_transcript: Optional[str] = None) -> List[str]:
+    """
+    Determined fields whose supporting text was touched by refinement: the segments locate_field links the
+    value to (in the raw store text) overlap a changed range of it. Values that cannot be located fall back
+    to sharing a changed word. Missing fields are left to the retry passes.
+    """
+    if len(store) == 0 or not ranges:
+        return []
+    mapper = store.offset_map(refined_transcript) if refined_transcript else None
+    weights = label_weights(template)
+    changed_words = set(content_words(WORD_RE.findall(" ".join(store.text[a:b] for a, b in ranges).lower())))
+    affected = []
+    for field in iter_fields(template):
+        fid = field["field_id"]
+        value = extracted.get(fid, NOT_DETERMINED)
+        if value in (NOT_DETERMINED, "", []) or fid in affected:
+            continue
+        span = locate_field(store, field, value, weights, refined_transcript, mapper)
+        if span is not None:
+            seg_start = store.offsets[span["segment_start"]]
+            seg_end = store.offsets[span["segment_end"]] + len(store.segment_text(span["segment_end"]))
+            if any(a <= seg_end and b >= seg_start for a, b in ranges):
+                affected.append(fid)
+        elif changed_words & set(WORD_RE.findall(" ".join(value_snippets(field, value)).lower())):
+            affected.append(fid)
+    return affected
@@ -0,0 +1,132 @@
+import os
+import json
+import time
+import hashlib
+from pathlib import Path
+from typing import Any, Optional
+
+# "file" works across workers on one host (and in tests); "redis" across hosts
+SHARED_STORE = os.getenv("SHARED_STORE", "file")
+SHARED_STORE_DIR = Path(os.getenv("SHARED_STORE_DIR", "shared_store"))
+# Each FileStore purges expired entries after this many writes; entries nobody reads again would otherwise pile up
+PURGE_EVERY_SETS = int(os.getenv("SHARED_STORE_PURGE_EVERY", "500"))
+# Temp files younger than this may still be being written by another worker
+STALE_TMP_SECONDS = 60
+
+
+class SharedStore:
+    """Key/value store for JSON-serialisable values that every worker process can see."""
+
+    def get(self, key: str) -> Optional[Any]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: Any, ttl: Optional[int] = None):
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+
+class FileStore(SharedStore):
+    """
+    One JSON file per key under a directory. Writes go to a temp file and are renamed into
+    place, so readers never see a partial value. Expired entries are removed on read and by
+    a purge every purge_every writes.
+    """
+
+    def __init__(self, directory: Path = SHARED_STORE_DIR, purge_every: int = PURGE_EVERY_SETS):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.purge_every = purge_every
+        self._sets = 0
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{hashlib.sha1(key.encode('utf-8')).hexdigest()}.json"
+
+    def get(self, key: str) -> Optional[Any]:
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if entry.get("expires") is not None and entry["expires"] <= time.time():
+            self.delete(key)
+            return None
+        return entry["value"]
+
+    def set(self, key: str, value: Any, ttl: Optional[int] = None):
+        path = self._path(key)
+        entry = {"key": key, "expires": time.time() + ttl if ttl else None, "value": value}
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path)
+        self._sets += 1
+        if self.purge_every and self._sets % self.purge_every == 0:
+            self.purge_expired()
+
+    def delete(self, key: str):
+        try:
+            self._path(key).unlink()
+        except FileNotFoundError:
+            pass
+
+    def purge_expired(self) -> int:
+        """Remove expired entries and abandoned temp files. Returns the number of files removed."""
+        removed = 0
+        now = time.time()
+        for path in self.directory.glob("*.tmp"):
+            try:
+                if path.stat().st_mtime > now - STALE_TMP_SECONDS:
+                    continue
+            except FileNotFoundError:
+                continue
+            path.unlink(missing_ok=True)
+            removed += 1
+        for path in self.directory.glob("*.json"):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    expires = json.load(f).get("expires")
+            except (FileNotFoundError, ValueError):
+                continue
+            if expires is not None and expires <= now:
+                path.unlink(missing_ok=True)
+                removed += 1
+        return removed
+
+
+class RedisStore(SharedStore):
+    """Redis-backed store for deployments spanning several hosts. Requires the redis package."""
+
+    def __init__(self, url: str):
+        try:
+            import redis
+        except ImportError:
+            raise ImportError("SHARED_STORE=redis requires the 'redis' package (pip install redis)")
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self.client.get(key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key: str, value: Any, ttl: Optional[int] = None):
+        self.client.set(key, json.dumps(value), ex=ttl)
+
+    def delete(self, key: str):
+        self.client.delete(key)
+
+
+# Singleton instance
+shared_store = None
+
+def get_shared_store():
+    global shared_store
+    if shared_store is None:
+        if SHARED_STORE == "file":
+            shared_store = FileStore()
+        elif SHARED_STORE == "redis":
+            shared_store = RedisStore(os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+        else:
+            raise ValueError(f"Unknown SHARED_STORE: {SHARED_STORE}")
+    return shared_store
@@ -0,0 +1,96 @@
+import os
+import json
+import mmap
+import struct
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+# Single read-only file holding every template as compact JSON, memory-mapped by each worker.
+# Layout: MAGIC | u64 header length | header JSON | template bytes.
+# The header maps template_id -> [offset, length] into the template bytes and carries index.json.
+MAGIC = b"CAPPACK1"
+_HEADER_LEN = struct.Struct("<Q")
+
+
+def source_mtime(templates_dir: Path) -> float:
+    """Latest modification time across index.json and every template file in templates_dir."""
+    return max((p.stat().st_mtime for p in templates_dir.glob("*.json")), default=0.0)
+
+
+def build_pack(templates_dir: Path, pack_path: Path) -> Path:
+    """Compile all template JSON files in templates_dir into pack_path (written atomically)."""
+    index_path = templates_dir / "index.json"
+    with open(index_path, "r", encoding="utf-8") as f:
+        index = json.load(f)
+
+    blobs = []
+    offsets: Dict[str, list] = {}
+    position = 0
+    for entry in index.get("templates", []):
+        template_path = templates_dir / entry["filename"]
+        if not template_path.exists():
+            continue
+        with open(template_path, "r", encoding="utf-8") as f:
+            blob = json.dumps(json.load(f), separators=(",", ":")).encode("utf-8")
+        offsets[entry["template_id"]] = [position, len(blob)]
+        blobs.append(blob)
+        position += len(blob)
+
+    header = json.dumps({
+        "source_mtime": source_mtime(templates_dir),
+        "index": index,
+        "templates": offsets,
+    }, separators=(",", ":")).encode("utf-8")
+
+    pack_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = pack_path.with_name(f"{pack_path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(_HEADER_LEN.pack(len(header)))
+        f.write(header)
+        for blob in blobs:
+            f.write(blob)
+    # Readers that already mapped the old file keep their mapping; new readers see the new pack
+    os.replace(tmp_path, pack_path)
+    return pack_path
+
+
+def is_stale(templates_dir: Path, pack_path: Path) -> bool:
+    if not pack_path.exists():
+        return True
+    try:
+        with open(pack_path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                return True
+            (header_len,) = _HEADER_LEN.unpack(f.read(_HEADER_LEN.size))
+            header = json.loads(f.read(header_len))
+    except (OSError, ValueError, struct.error):
+        return True
+    return header.get("source_mtime", 0) < source_mtime(templates_dir)
+
+
+class TemplatePack:
+    """Read-only, memory-mapped view of a template pack. Pages are shared between processes."""
+
+    def __init__(self, pack_path: Path):
+        with open(pack_path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"Not a template pack: {pack_path}")
+        (header_len,) = _HEADER_LEN.unpack_from(self._mm, len(MAGIC))
+        header_start = len(MAGIC) + _HEADER_LEN.size
+        header = json.loads(self._mm[header_start:header_start + header_len])
+        self._data_start = header_start + header_len
+        self.index = header["index"]
+        self._offsets = header["templates"]
+
+    def __contains__(self, template_id: str) -> bool:
+        return template_id in self._offsets
+
+    def load(self, template_id: str) -> Optional[Dict[str, Any]]:
+        location = self._offsets.get(template_id)
+        if location is None:
+            return None
+        offset, length = location
+        start = self._data_start + offset
+        return json.loads(self._mm[start:start + length])
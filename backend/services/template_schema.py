@@ -0,0 +1,110 @@
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from services.templates import iter_fields
+
+NOT_DETERMINED = "not determined"
+
+
+def _option_values(field: Dict[str, Any]) -> List[str]:
+    values = []
+    for option in field.get("options", []):
+        if option["value"] not in values:
+            values.append(option["value"])
+    return values
+
+
+def _field_schema(field: Dict[str, Any]) -> Dict[str, Any]:
+    f_type = field.get("type", "free_text")
+    description = field.get("label", field["field_id"])
+    if f_type == "single_select" and field.get("options"):
+        return {"type": "string", "enum": _option_values(field) + [NOT_DETERMINED], "description": description}
+    if f_type == "multi_select" and field.get("options"):
+        return {
+            "type": "array",
+            "items": {"type": "string", "enum": _option_values(field) + [NOT_DETERMINED]},
+            "description": description,
+        }
+    return {"type": "string", "description": description}
+
+
+def build_json_schema(template: Dict[str, Any], field_ids: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+    """
+    JSON schema for the extraction output of a template.
+    Selects become enums of their option values, multi_selects arrays of those enums.
+    field_ids restricts the schema to a subset of fields (e.g. retries and repairs).
+    """
+    wanted = set(field_ids) if field_ids is not None else None
+    properties = {}
+    for field in iter_fields(template):
+        if wanted is None or field["field_id"] in wanted:
+            properties[field["field_id"]] = _field_schema(field)
+    return {
+        "title": "cap_extraction",
+        "description": f"Extracted CAP protocol fields for {template.get('organ') or template.get('template_id')}. "
+                       f"Use \"{NOT_DETERMINED}\" when the transcript does not state a field.",
+        "type": "object",
+        "properties": properties,
+    }
+
+
+def _match_option(field: Dict[str, Any], value: Any) -> Optional[str]:
+    """Map a value or option label (case-insensitive) to the canonical option value."""
+    if not isinstance(value, str):
+        return None
+    needle = value.strip().lower()
+    if needle == NOT_DETERMINED:
+        return NOT_DETERMINED
+    for option in field.get("options", []):
+        if needle in (option["value"].lower(), option.get("label", "").strip().lower()):
+            return option["value"]
+    return None
+
+
+def validate_extraction(template: Dict[str, Any], data: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, str]]:
+    """
+    Check extracted values against the template options.
+    Returns (valid, invalid): valid values are normalised to canonical option values,
+    invalid maps field_id to a short reason. Keys that are not template fields are dropped.
+    """
+    fields = {field["field_id"]: field for field in iter_fields(template)}
+    valid: Dict[str, Any] = {}
+    invalid: Dict[str, str] = {}
+
+    for field_id, value in data.items():
+        field = fields.get(field_id)
+        if field is None:
+            continue
+        f_type = field.get("type", "free_text")
+
+        if f_type == "single_select" and field.get("options"):
+            matched = _match_option(field, value)
+            if matched is None:
+                invalid[field_id] = f"{value!r} is not one of the options"
+            else:
+                valid[field_id] = matched
+
+        elif f_type == "multi_select" and field.get("options"):
+            items = value if isinstance(value, list) else [value]
+            matched = [_match_option(field, item) for item in items]
+            bad = [item for item, m in zip(items, matched) if m is None]
+            if bad:
+                invalid[field_id] = f"{bad!r} are not among the options"
+                continue
+            selected = [m for m in matched if m != NOT_DETERMINED]
+            valid[field_id] = selected if selected else NOT_DETERMINED
+
+        else:
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                value = str(value)
+            if not isinstance(value, str):
+                invalid[field_id] = "expected text"
+            else:
+                valid[field_id] = value.strip() or NOT_DETERMINED
+
+    return valid, invalid
+
+
+def describe_fields(template: Dict[str, Any], field_ids: Iterable[str]) -> List[Dict[str, Any]]:
+    """The questionnaire entries for a subset of fields, in template order."""
+    wanted = set(field_ids)
+    return [field for field in iter_fields(template) if field["field_id"] in wanted]
@@ -0,0 +1,105 @@
+import os
+import json
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+from services.template_pack import TemplatePack, build_pack, is_stale, source_mtime
+
+# Resolve relative to this file so the backend works from any working directory
+TEMPLATES_DIR = Path(__file__).resolve().parents[2] / "CAP templates" / "JSON_Output"
+INDEX_PATH = TEMPLATES_DIR / "index.json"
+TEMPLATE_PACK_PATH = Path(os.getenv(
+    "TEMPLATE_PACK_PATH",
+    Path(__file__).resolve().parents[1] / "data" / "templates.pack"
+))
+
+_pack = None
+_pack_checked = False
+
+
+def get_template_pack() -> Optional[TemplatePack]:
+    """The memory-mapped template pack, or None if it has not been built or is out of date."""
+    global _pack, _pack_checked
+    if not _pack_checked:
+        _pack_checked = True
+        if not is_stale(TEMPLATES_DIR, TEMPLATE_PACK_PATH):
+            _pack = TemplatePack(TEMPLATE_PACK_PATH)
+    return _pack
+
+
+def build_template_pack() -> Path:
+    """(Re)build the template pack if any template changed. Run once before workers start."""
+    if is_stale(TEMPLATES_DIR, TEMPLATE_PACK_PATH):
+        build_pack(TEMPLATES_DIR, TEMPLATE_PACK_PATH)
+    return TEMPLATE_PACK_PATH
+
+
+def templates_mtime() -> float:
+    """Latest modification time across index.json and every template file."""
+    return source_mtime(TEMPLATES_DIR)
+
+
+def load_index() -> Dict[str, Any]:
+    """Load the master index of CAP templates."""
+    pack = get_template_pack()
+    if pack is not None:
+        return pack.index
+    with open(INDEX_PATH, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+# Bounded: the pack is shared between workers, parsed templates are per process
+@lru_cache(maxsize=32)
+def load_template(template_id: str) -> Optional[Dict[str, Any]]:
+    """Load a template by id, or None if it does not exist."""
+    pack = get_template_pack()
+    if pack is not None:
+        return pack.load(template_id)
+    template_path = TEMPLATES_DIR / f"{template_id}.json"
+    if not template_path.exists():
+        # A few index entries (e.g. "..._(1)") have a filename that differs from the id
+        entry = next((t for t in load_index().get("templates", []) if t["template_id"] == template_id), None)
+        if entry is None:
+            return None
+        template_path = TEMPLATES_DIR / entry["filename"]
+        if not template_path.exists():
+            return None
+    with open(template_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def iter_index_entries() -> Iterator[Dict[str, Any]]:
+    """Yield index entries that have a template file on disk, skipping "_(1)" duplicates."""
+    entries = load_index().get("templates", [])
+    ids = {t["template_id"] for t in entries}
+    for entry in entries:
+        template_id = entry["template_id"]
+        if template_id.endswith("_(1)") and template_id[:-4] in ids:
+            continue
+        if (TEMPLATES_DIR / entry["filename"]).exists():
+            yield entry
+
+
+def iter_fields(template: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """Yield every field of a template in document order."""
+    for section in template.get("sections", []):
+        for field in section.get("fields", []):
+            yield field
+
+
+def template_vocabulary(template: Dict[str, Any]) -> List[str]:
+    """Section names, field labels and option labels of a template."""
+    texts = []
+    for section in template.get("sections", []):
+        texts.append(section.get("section_name", ""))
+        for field in section.get("fields", []):
+            texts.append(field.get("label", ""))
+            for option in field.get("options", []):
+                texts.append(option.get("label", ""))
+    return [t for t in texts if t]
+
+
+if __name__ == "__main__":
+    # Compile the template pack, e.g. during a Docker build: python -m services.templates
+    print(f"Template pack at {build_template_pack()}")
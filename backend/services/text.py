@@ -0,0 +1,14 @@
+import re
+from typing import Iterable, List
+
+WORD_RE = re.compile(r"[a-z0-9]+")
+# Words too common to tie a phrase to one field, segment or refinement edit
+STOPWORDS = {
+    "the", "and", "for", "with", "are", "was", "were", "this", "that", "from", "not", "all", "has", "have",
+    "its", "but", "specify", "other", "present", "identified", "cannot", "determined",
+}
+
+
+def content_words(words: Iterable[str]) -> List[str]:
+    """The words (already lowercased) specific enough to carry meaning: no stopwords or 1-2 letter tokens."""
+    return [w for w in words if len(w) > 2 and w not in STOPWORDS]
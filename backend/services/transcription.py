@@ -82,6 +82,7 @@ class TranscriptionService:
         """
         Formats segments into the requested string format:
         [0.00 - 2.00] text
+        Display only; prompts use the timestamp-free SegmentStore.text.
         """
         lines = []
         for s in segments:
@@ -0,0 +1,53 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from services.protocol_classifier import ProtocolClassifier
+
+DICTATIONS = json.loads((Path(__file__).parent / "data" / "dictations.json").read_text(encoding="utf-8"))
+GENERIC_TEMPLATES = {"Tumor_1.1.0.0.REL_CAPCP", "Tumor.Bx_1.0.1.0.REL_CAPCP"}
+
+
+@pytest.fixture(scope="module")
+def classifier(tmp_path_factory):
+    return ProtocolClassifier(vectors_path=tmp_path_factory.mktemp("vectors") / "protocol_vectors.bin")
+
+
+@pytest.fixture(scope="module")
+def results(classifier):
+    return [(d["template_id"], classifier.classify(d["transcript"], use_llm_fallback=False)) for d in DICTATIONS]
+
+
+def test_expected_template_is_always_a_candidate(results):
+    # The LLM fallback chooses among the candidates, so this bounds end-to-end accuracy
+    missing = [gold for gold, r in results if gold not in [c["template_id"] for c in r["candidates"]]]
+    assert missing == []
+
+
+def test_top1_accuracy(results):
+    correct = sum(gold == r["template_id"] for gold, r in results)
+    assert correct / len(results) >= 0.8
+
+
+def test_confident_local_decisions_are_right_and_fallback_rate_is_bounded(classifier, results):
+    confident = [(gold, r) for gold, r in results if r["confidence"] >= classifier.threshold]
+    wrong = [(gold, r["template_id"]) for gold, r in confident if gold != r["template_id"]]
+    assert len(wrong) / len(confident) <= 0.1, wrong
+    assert 1 - len(confident) / len(results) <= 0.35
+
+
+def test_generic_tumor_template_does_not_win_organ_specific_dictations(results):
+    assert [gold for gold, r in results if r["template_id"] in GENERIC_TEMPLATES] == []
+
+
+def test_confidence_is_the_relative_margin(classifier):
+    candidates = classifier.rank(DICTATIONS[0]["transcript"])
+    first, second = candidates[0]["score"], candidates[1]["score"]
+    assert candidates[0]["confidence"] == pytest.approx((first - second) / first, abs=1e-3)
+    assert all(c["confidence"] == 0.0 for c in candidates[1:])
+
+
+def test_empty_transcript_has_no_candidates(classifier):
+    result = classifier.classify("", use_llm_fallback=False)
+    assert result["template_id"] is None and result["candidates"] == []
@@ -0,0 +1,55 @@
+from services.segments import SegmentStore, changed_ranges, fields_affected_by_changes
+
+from tests.test_segments import TEMPLATE, make_store
+
+
+def changed_text(raw, refined):
+    return [raw[a:b] for a, b in changed_ranges(raw, refined)]
+
+
+def test_changed_ranges_are_raw_side_spans():
+    raw = "Lymphovascular in vasion not identified.\nMargins negative."
+    assert changed_text(raw, raw.replace("in vasion", "invasion")) == ["in vasion"]
+
+
+def test_changed_ranges_ignore_case_punctuation_and_stopwords():
+    raw = "tumor size 2 cm, margins negative"
+    assert changed_ranges(raw, "Tumor size 2 cm. Margins negative.") == []
+    assert changed_ranges(raw, "The tumor size 2 cm, and margins negative") == []
+
+
+def test_changed_ranges_insertion_is_empty_range_at_insertion_point():
+    raw = "tumor size cm"
+    ranges = changed_ranges(raw, "tumor size 2.5 cm")
+    assert ranges == [(11, 11)]
+
+
+def test_edit_next_to_a_generic_value_re_extracts_its_field():
+    raw_lines = ("Perineural invasion not identified.", "Lymphovascular in vasion not identified.")
+    store = make_store(*raw_lines)
+    refined = store.text.replace("in vasion", "invasion")
+    ranges = changed_ranges(store.text, refined)
+    extracted = {"lvi": "not_identified", "pni": "not_identified"}
+    assert fields_affected_by_changes(TEMPLATE, extracted, store, ranges, refined) == ["lvi"]
+
+
+def test_label_only_fixed_by_refinement_is_still_found():
+    store = make_store("Perineural invasion not identified.", "Lymph of ascular in vasion present.")
+    refined = "Perineural invasion not identified.\nLymphovascular invasion present."
+    ranges = changed_ranges(store.text, refined)
+    extracted = {"lvi": "present", "pni": "not_identified"}
+    assert fields_affected_by_changes(TEMPLATE, extracted, store, ranges, refined) == ["lvi"]
+
+
+def test_edits_elsewhere_leave_fields_alone():
+    store = make_store("Lymphovascular invasion not identified.", "Perineural invasion not identified.",
+                       "Specimen received in for malin.")
+    refined = store.text.replace("for malin", "formalin")
+    ranges = changed_ranges(store.text, refined)
+    extracted = {"lvi": "not_identified", "pni": "not_identified"}
+    assert fields_affected_by_changes(TEMPLATE, extracted, store, ranges, refined) == []
+
+
+def test_empty_store_or_no_changes():
+    assert fields_affected_by_changes(TEMPLATE, {"lvi": "present"}, SegmentStore.from_segments([]), [(0, 1)]) == []
+    assert fields_affected_by_changes(TEMPLATE, {"lvi": "present"}, make_store("LVI present."), []) == []
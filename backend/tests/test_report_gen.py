@@ -0,0 +1,30 @@
+import pytest
+
+docx = pytest.importorskip("docx")
+
+from services.report_gen import generate_radiology_report
+
+from tests.test_template_schema import TEMPLATE
+
+
+def field_lines(path):
+    return [p.text for p in docx.Document(str(path)).paragraphs if ": " in p.text]
+
+
+def test_select_values_are_rendered_as_option_labels(tmp_path):
+    path = tmp_path / "report.docx"
+    generate_radiology_report({"procedure": "mastectomy", "margins": ["anterior", "posterior"], "size": "2 cm"},
+                              TEMPLATE, str(path))
+    lines = field_lines(path)
+    assert "Procedure: Total mastectomy" in lines
+    assert "Margins Involved: Anterior, Posterior" in lines
+    assert "Size: 2 cm" in lines
+    assert "Comment: not determined" in lines
+
+
+def test_multi_select_edited_as_comma_separated_text(tmp_path):
+    path = tmp_path / "report.docx"
+    generate_radiology_report({"margins": "anterior, posterior", "procedure": "not determined"}, TEMPLATE, str(path))
+    lines = field_lines(path)
+    assert "Margins Involved: Anterior, Posterior" in lines
+    assert "Procedure: not determined" in lines
@@ -0,0 +1,112 @@
+from services.segments import SegmentStore, link_fields, mentioned_fields
+
+OPTIONS = [
+    {"value": "not_identified", "label": "Not identified"},
+    {"value": "present", "label": "Present"},
+    {"value": "cannot_be_determined", "label": "Cannot be determined: _________________"},
+]
+
+TEMPLATE = {
+    "sections": [{
+        "section_name": "Tumor",
+        "fields": [
+            {"field_id": "histologic_type", "label": "Histologic Type", "type": "single_select",
+             "options": [{"value": "squamous_cell_carcinoma", "label": "Squamous cell carcinoma"}]},
+            {"field_id": "lvi", "label": "Lymphovascular Invasion", "type": "single_select", "options": OPTIONS},
+            {"field_id": "pni", "label": "Perineural Invasion", "type": "single_select", "options": OPTIONS},
+            {"field_id": "tumor_comment", "label": "Tumor Comment: _________________", "type": "free_text"},
+        ],
+    }]
+}
+
+
+def make_store(*lines):
+    return SegmentStore.from_segments(
+        [{"start": 3.0 * i, "end": 3.0 * (i + 1), "text": line} for i, line in enumerate(lines)]
+    )
+
+
+def test_fields_sharing_an_option_label_link_to_their_own_segment():
+    store = make_store("Lymphovascular invasion not identified.", "Perineural invasion not identified.")
+    provenance = link_fields(store, TEMPLATE, {"lvi": "not_identified", "pni": "not_identified"})
+    assert (provenance["lvi"]["start"], provenance["lvi"]["end"]) == (0.0, 3.0)
+    assert (provenance["pni"]["start"], provenance["pni"]["end"]) == (3.0, 6.0)
+
+
+def test_value_on_the_line_after_the_label():
+    store = make_store("Perineural invasion present.", "Lymphovascular invasion:", "Not identified.")
+    provenance = link_fields(store, TEMPLATE, {"lvi": "not_identified", "pni": "present"})
+    assert provenance["lvi"]["segment_start"] == 2
+    assert provenance["pni"]["segment_start"] == 0
+
+
+def test_generic_value_without_label_mention_is_not_linked():
+    store = make_store("Perineural invasion not identified.")
+    assert "lvi" not in link_fields(store, TEMPLATE, {"lvi": "not_identified"})
+
+
+def test_distinctive_values_are_found_without_the_label():
+    store = make_store("Margins are clear.", "Squamous cell carcinoma, moderately differentiated.",
+                       "Small ulcer near the dentate line.")
+    provenance = link_fields(store, TEMPLATE, {
+        "histologic_type": "squamous_cell_carcinoma",
+        "tumor_comment": "ulcer near the dentate line",
+    })
+    assert provenance["histologic_type"]["segment_start"] == 1
+    assert provenance["tumor_comment"]["segment_start"] == 2
+
+
+def test_words_match_on_boundaries_only():
+    store = make_store("This represents a benign cyst.")
+    assert store.locate("present") is None
+
+
+def test_value_only_in_refined_transcript_maps_back_to_raw_segment():
+    store = make_store("Right adrenal gland.", "Lymph of ascular in vasion present.")
+    refined = "Right adrenal gland.\nLymphovascular invasion present."
+    provenance = link_fields(store, TEMPLATE, {"lvi": "present"}, refined)
+    assert provenance["lvi"]["segment_start"] == 1
+
+
+def test_empty_store():
+    store = make_store()
+    assert len(store) == 0
+    assert store.locate("present") is None
+    assert link_fields(store, TEMPLATE, {"lvi": "present"}) == {}
+
+
+def test_mentioned_fields_need_the_distinctive_label_words():
+    text = "Perineural invasion not identified.\nSquamous cell carcinoma."
+    assert mentioned_fields(TEMPLATE, text) == ["pni"]
+
+
+def test_time_lookups_with_overlapping_segments():
+    store = SegmentStore.from_segments([
+        {"start": 4.0, "end": 6.0, "text": "third"},
+        {"start": 0.0, "end": 5.0, "text": "first, long"},
+        {"start": 1.0, "end": 2.0, "text": "second"},
+    ])
+    assert [store.segment_text(i) for i in range(len(store))] == ["first, long", "second", "third"]
+    assert store.at_time(1.5) == [0, 1]
+    assert store.at_time(4.5) == [0, 2]
+    assert store.at_time(7.0) == []
+    assert store.between(2.5, 3.5) == [0]
+    assert store.between(0.0, 10.0) == [0, 1, 2]
+
+
+def test_character_spans_map_to_segments_and_audio_time():
+    store = make_store("Tumor size 2 cm.", "Margins negative.")
+    start = store.text.index("Margins")
+    assert store.segment_at_offset(0) == 0
+    assert store.segment_at_offset(start - 1) == 0
+    assert store.segment_at_offset(start) == 1
+    span = store.span(0, start + 3)
+    assert (span["segment_start"], span["segment_end"], span["start"], span["end"]) == (0, 1, 0.0, 6.0)
+
+
+def test_offset_map_aligns_refined_text_with_raw_text():
+    store = make_store("a drain all ectomy, right.", "Margins negative.")
+    refined = "Adrenalectomy, right.\nMargins negative."
+    to_raw = store.offset_map(refined)
+    assert to_raw(refined.index("Margins")) == store.text.index("Margins")
+    assert to_raw(refined.index("right")) == store.text.index("right")
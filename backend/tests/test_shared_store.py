@@ -0,0 +1,36 @@
+import os
+import time
+
+from services.shared_store import FileStore
+
+
+def test_set_get_delete(tmp_path):
+    store = FileStore(tmp_path)
+    store.set("chat_session:a", {"history": []})
+    assert store.get("chat_session:a") == {"history": []}
+    store.delete("chat_session:a")
+    assert store.get("chat_session:a") is None
+
+
+def test_expired_entries_are_purged_without_being_read(tmp_path):
+    store = FileStore(tmp_path, purge_every=3)
+    store.set("extraction:old", 1, ttl=1)
+    entry = store._path("extraction:old")
+    time.sleep(1.1)
+    store.set("a", 1)
+    assert entry.exists()
+    store.set("b", 2)
+    assert not entry.exists()
+    assert store.get("a") == 1 and store.get("b") == 2
+
+
+def test_purge_keeps_fresh_temp_files(tmp_path):
+    store = FileStore(tmp_path)
+    fresh = tmp_path / "fresh.json.1.tmp"
+    stale = tmp_path / "stale.json.2.tmp"
+    fresh.write_text("{}")
+    stale.write_text("{}")
+    old = time.time() - 3600
+    os.utime(stale, (old, old))
+    assert store.purge_expired() == 1
+    assert fresh.exists() and not stale.exists()
@@ -0,0 +1,69 @@
+from services.template_schema import NOT_DETERMINED, build_json_schema, describe_fields, validate_extraction
+
+TEMPLATE = {
+    "template_id": "Test_1.0",
+    "sections": [{
+        "section_name": "Specimen",
+        "fields": [
+            {"field_id": "procedure", "label": "Procedure", "type": "single_select", "options": [
+                {"value": "lumpectomy", "label": "Lumpectomy"},
+                {"value": "mastectomy", "label": "Total mastectomy"},
+                {"value": "lumpectomy", "label": "Lumpectomy (duplicate)"},
+            ]},
+            {"field_id": "margins", "label": "Margins Involved", "type": "multi_select", "options": [
+                {"value": "anterior", "label": "Anterior"},
+                {"value": "posterior", "label": "Posterior"},
+            ]},
+            {"field_id": "comment", "label": "Comment", "type": "free_text"},
+            {"field_id": "size", "label": "Size", "type": "free_text"},
+        ],
+    }],
+}
+
+
+def test_schema_has_enums_for_selects_and_strings_for_free_text():
+    properties = build_json_schema(TEMPLATE)["properties"]
+    assert properties["procedure"]["enum"] == ["lumpectomy", "mastectomy", NOT_DETERMINED]
+    assert properties["margins"]["type"] == "array"
+    assert properties["margins"]["items"]["enum"] == ["anterior", "posterior", NOT_DETERMINED]
+    assert properties["comment"] == {"type": "string", "description": "Comment"}
+
+
+def test_schema_can_be_limited_to_some_fields():
+    assert list(build_json_schema(TEMPLATE, ["size", "procedure"])["properties"]) == ["procedure", "size"]
+
+
+def test_select_values_and_labels_are_normalised_to_option_values():
+    valid, invalid = validate_extraction(TEMPLATE, {"procedure": " Total Mastectomy ", "margins": ["Anterior", "posterior"]})
+    assert valid == {"procedure": "mastectomy", "margins": ["anterior", "posterior"]}
+    assert invalid == {}
+
+
+def test_invalid_options_are_reported_per_field():
+    valid, invalid = validate_extraction(TEMPLATE, {"procedure": "biopsy", "margins": ["anterior", "lateral"]})
+    assert valid == {}
+    assert set(invalid) == {"procedure", "margins"}
+    assert "lateral" in invalid["margins"]
+
+
+def test_multi_select_normalisation():
+    valid, _ = validate_extraction(TEMPLATE, {"margins": "Anterior"})
+    assert valid["margins"] == ["anterior"]
+    valid, _ = validate_extraction(TEMPLATE, {"margins": [NOT_DETERMINED]})
+    assert valid["margins"] == NOT_DETERMINED
+    valid, _ = validate_extraction(TEMPLATE, {"margins": []})
+    assert valid["margins"] == NOT_DETERMINED
+    valid, _ = validate_extraction(TEMPLATE, {"margins": ["anterior", NOT_DETERMINED]})
+    assert valid["margins"] == ["anterior"]
+
+
+def test_free_text_and_unknown_keys():
+    valid, invalid = validate_extraction(TEMPLATE, {"size": 2.5, "comment": "  ", "unknown": "x", "procedure": None})
+    assert valid == {"size": "2.5", "comment": NOT_DETERMINED}
+    assert list(invalid) == ["procedure"]
+    _, invalid = validate_extraction(TEMPLATE, {"comment": ["a"]})
+    assert invalid == {"comment": "expected text"}
+
+
+def test_describe_fields_keeps_template_order():
+    assert [f["field_id"] for f in describe_fields(TEMPLATE, ["size", "procedure"])] == ["procedure", "size"]
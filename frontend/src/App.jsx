@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import './App.css';
 
 const API_BASE = import.meta.env.VITE_API_URL || 'http://localhost:8000';
@@ -17,6 +17,9 @@ function App() {
   const [extractedData, setExtractedData] = useState({});
   const [templateDetails, setTemplateDetails] = useState(null);
   const [downloadUrl, setDownloadUrl] = useState('');
+  const [audioUrl, setAudioUrl] = useState('');
+  const [provenance, setProvenance] = useState({});
+  const audioRef = useRef(null);
 
   // Recorder State
   const [isRecordingMode, setIsRecordingMode] = useState(false);
@@ -30,6 +33,7 @@ function App() {
   const [chatMessages, setChatMessages] = useState([]);
   const [chatInput, setChatInput] = useState('');
   const [chatLoading, setChatLoading] = useState(false);
+  const [chatSessionId, setChatSessionId] = useState(null);
 
   // Recording Logic
   const startRecording = async () => {
@@ -96,7 +100,10 @@ function App() {
       setRawTranscript(data.raw_transcript);
       setSegments(data.segments);
       setRefinedTranscript(data.refined_transcript);
+      setChatSessionId(null);
       setExtractedData(data.extracted_data);
+      setProvenance(data.provenance || {});
+      setAudioUrl(data.audio_url ? `${API_BASE}${data.audio_url}` : '');
 
       // Fetch details for rendering the form
       const templateRes = await fetch(`${API_BASE}/template/${data.template_id}.json`);
@@ -112,6 +119,14 @@ function App() {
     }
   };
 
+  // Jump the player to the dictation behind an extracted field
+  const playFieldSource = (fieldId) => {
+    const span = provenance[fieldId];
+    if (!span || !audioRef.current) return;
+    audioRef.current.currentTime = span.start;
+    audioRef.current.play();
+  };
+
   const handleVerifyTranscript = () => {
     setStep(3);
   };
@@ -143,19 +158,27 @@ function App() {
     setChatInput('');
     setChatLoading(true);
 
+    // Full context is only sent when there is no live server-side session
+    const fullContext = {
+      transcript: refinedTranscript,
+      body_part: templateDetails?.organ || '',
+      template_id: selectedTemplate,
+      history: chatMessages
+    };
+    const postChat = (body) => fetch(`${API_BASE}/chat`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ message: chatInput, ...body }),
+    });
+
     try {
-      const res = await fetch(`${API_BASE}/chat`, {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({
-          message: chatInput,
-          transcript: refinedTranscript,
-          body_part: templateDetails?.organ || '',
-          template_id: selectedTemplate,
-          history: chatMessages
-        }),
-      });
+      let res = await postChat(chatSessionId ? { session_id: chatSessionId } : fullContext);
+      if (res.status === 404) {
+        // Session expired on the server; reseed it
+        res = await postChat(fullContext);
+      }
       const data = await res.json();
+      setChatSessionId(data.session_id);
       setChatMessages(prev => [...prev, { role: 'ai', content: data.response }]);
     } catch (err) {
       console.error(err);
@@ -171,6 +194,9 @@ function App() {
     setSelectedTemplate('');
     setDownloadUrl('');
     setChatMessages([]);
+    setChatSessionId(null);
+    setProvenance({});
+    setAudioUrl('');
   };
 
   return (
@@ -318,7 +344,7 @@ function App() {
                 </label>
                 <textarea
                   value={refinedTranscript}
-                  onChange={(e) => setRefinedTranscript(e.target.value)}
+                  onChange={(e) => { setRefinedTranscript(e.target.value); setChatSessionId(null); }}
                   rows={15}
                   className="textarea-input"
                   style={{ width: '100%', padding: '1rem', border: '1px solid var(--border)', borderRadius: 'var(--radius)', fontFamily: 'Inter, sans-serif' }}
@@ -340,6 +366,10 @@ function App() {
               Edit any field if necessary before clicking <b>Approve & Generate Report</b>.
             </p>
 
+            {audioUrl && (
+              <audio ref={audioRef} controls src={audioUrl} style={{ width: '100%', marginBottom: '1.5rem' }} />
+            )}
+
             <div className="form-container" style={{ background: '#fff', padding: '2rem', borderRadius: 'var(--radius)', border: '1px solid var(--border)' }}>
               {templateDetails?.sections.map((section, idx) => (
                 <div key={idx} className="form-section" style={{ marginBottom: '2.5rem' }}>
@@ -349,7 +379,20 @@ function App() {
                   <div className="fields-grid" style={{ display: 'grid', gridTemplateColumns: '1fr 1fr', gap: '1.5rem' }}>
                     {section.fields.map((field) => (
                       <div key={field.field_id} className="field-group">
-                        <label style={{ display: 'block', fontSize: '0.85rem', fontWeight: 600, marginBottom: '0.5rem' }}>{field.label}</label>
+                        <label style={{ display: 'block', fontSize: '0.85rem', fontWeight: 600, marginBottom: '0.5rem' }}>
+                          {field.label}
+                          {provenance[field.field_id] && audioUrl && (
+                            <button
+                              type="button"
+                              className="btn"
+                              onClick={() => playFieldSource(field.field_id)}
+                              title="Play the dictation behind this field"
+                              style={{ marginLeft: '0.5rem', padding: '0 0.4rem', fontSize: '0.7rem' }}
+                            >
+                              ▶ {provenance[field.field_id].start.toFixed(1)}s
+                            </button>
+                          )}
+                        </label>
                         {field.type === 'select' ? (
                           <select
                             value={extractedData[field.field_id] || ''}